@@ -35,6 +35,9 @@ setup(
                            "statsmodels == 0.14.1",
                            "colorama"],
         
+        extras_require={"parquet": ["pyarrow"],
+                        "bigwig": ["pyBigWig"]},
+        
         entry_points={
         'console_scripts': [
             'tnseeker=tnseeker.__main__:main',  # Replace `2fast2q` with the command name you want to use
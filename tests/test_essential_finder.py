@@ -0,0 +1,86 @@
+import numpy as np
+import statsmodels.stats.multitest
+import tnseeker.Essential_Finder as ef
+
+
+def contig_variables(seq, insertions):
+    ''' Run variables for a single contig "c", with the given (1 based) +
+    strand insertions compiled and ranked, as gene_insertion_matrix does. '''
+
+    variables = ef.Variables(borders_contig={}, orientation_contig={}, insertions_contig={},
+                             genome_seq={"c": seq})
+    variables.motif_index["c"] = ef.motif_indexer(seq)
+    variables.insertions_contig["c"] = list(insertions)
+    variables.borders_contig["c"] = [0] * len(insertions)
+    variables.orientation_contig["c"] = ["+"] * len(insertions)
+    ef.variables = variables
+    ef.gene_insertion_matrix({})
+    return variables
+
+
+def test_domain_statistics_region_ending_at_contig_end():
+    rng = np.random.default_rng(0)
+    seq = "".join(rng.choice(list("ATCG"), 1000))
+    variables = contig_variables(seq, [850, 910, 990, 1000])
+
+    # a gene and an intergenic region ending at the last base of the contig
+    basket = {"g": ef.Gene(gene="g", start=900, end=1000, contig="c"),
+              "IR": ef.Gene(gene="IR", start=800, end=1000, contig="c")}
+    basket["g"].domains = [900, 950, 1000, 1000]
+    basket["IR"].domains = [800, 1000, 1000]
+
+    table = ef.domain_statistics(ef.GeneTable(basket))
+
+    for row, (start, end) in enumerate(zip(table.subdomain_start, table.subdomain_end)):
+        expected = ef.motif_counter(variables.motif_index["c"], start, end + 1)
+        assert np.array_equal(table.GC_content[row], expected)
+    assert table.subdomain_insertions.tolist() == [1, 1, 0, 3, 0]
+    assert table.insertions.tolist() == [2.0, 3.0]
+
+
+def roc_point(names, pvalues, no_insertions, threshold):
+    ''' The [1 - specificity, TPR] point of a single threshold, evaluating
+    every benchmark domain in order. '''
+
+    rejecting = statsmodels.stats.multitest.multipletests(pvalues, 0.05, "fdr_bh")[1]
+    untested = np.asarray(pvalues) * len(pvalues)
+    counts = []
+    for baseline, wrong_if_rejected in ((ef.variables.true_positives, False), (ef.variables.true_negatives, True)):
+        dropped, kept, assayed, wrong = set(), len(baseline), set(), set()
+        for name, rejects, untestable, empty in zip(names, rejecting, untested, no_insertions):
+            if (name not in baseline) or (name in dropped):
+                continue
+            rejected = rejects <= threshold
+            if (not rejected) and empty and (threshold <= untestable):
+                if kept >= 30:
+                    dropped.add(name)
+                    kept -= 1
+                continue
+            assayed.add(name)
+            if rejected == wrong_if_rejected:
+                wrong.add(name)
+        counts.append((len(assayed), len(wrong)))
+
+    (essentials, false_negatives), (non_essentials, false_positives) = counts
+    TPR = (essentials - false_negatives) / essentials if essentials else 0
+    specificity = 1 - (non_essentials - false_positives) / non_essentials if non_essentials else 0
+    return [specificity, TPR]
+
+
+def test_roc_sweep_matches_single_thresholds():
+    rng = np.random.default_rng(3)
+    genes = [f"g{i}" for i in range(45)]
+    for trial in range(20):
+        names = [genes[i] for i in np.sort(rng.integers(0, len(genes), 150))]  # the domains of a gene in a row
+        pvalues = np.where(rng.random(150) < 0.5, 10.0 ** -rng.uniform(1, 12, 150), rng.random(150))
+        no_insertions = rng.random(150) < 0.5
+        pvaluing_array = np.zeros((150, 6))
+        pvaluing_array[:, 5] = np.where(no_insertions, 0, 3)
+        order = rng.permutation(genes)
+        ef.variables = ef.Variables(true_positives=dict.fromkeys(order[:35], 1),
+                                    true_negatives=dict.fromkeys(order[35:], 1), pvalue=0.05)
+
+        thresholds, points = ef.roc_sweep(names, list(pvalues), pvaluing_array)
+        assert np.all(np.diff(thresholds) < 0) and thresholds[0] == 0.05
+        for threshold, point in zip(thresholds, points):
+            assert point.tolist() == roc_point(names, pvalues, no_insertions, threshold)
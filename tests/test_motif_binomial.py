@@ -0,0 +1,61 @@
+import numpy as np
+from tnseeker.extras.motif_binomial import motif_binomial_cdf, tilt_finder
+from tnseeker.extras.possion_binom import PoiBin
+
+
+def poisson_binomial_cdf(events, successes, chances):
+    return PoiBin(np.repeat(chances, events)).cdf(int(successes))
+
+
+def random_domains(rng, domains=40):
+    events = rng.integers(0, 12, size=(domains, 16)) * (rng.random((domains, 16)) < 0.6)
+    chances = rng.random((domains, 16)) * 0.3
+    successes = np.array([rng.integers(0, max(int(n.sum()), 1) + 1) for n in events])
+    return events, successes, chances
+
+
+def test_motif_binomial_cdf_matches_poisson_binomial():
+    rng = np.random.default_rng(7)
+    events, successes, chances = random_domains(rng)
+    cdf = motif_binomial_cdf(events, successes, chances)
+    expected = [poisson_binomial_cdf(n, k, p) for n, k, p in zip(events, successes, chances)]
+    np.testing.assert_allclose(cdf, expected, rtol=1e-6, atol=1e-300)
+
+    # a single vector of motif chances is shared by all domains
+    cdf = motif_binomial_cdf(events, successes, chances[0])
+    expected = [poisson_binomial_cdf(n, k, chances[0]) for n, k in zip(events, successes)]
+    np.testing.assert_allclose(cdf, expected, rtol=1e-6, atol=1e-300)
+
+
+def test_motif_binomial_cdf_without_insertions():
+    events = np.array([[10, 0, 5], [3, 4, 0]])
+    chances = np.array([0.1, 0.4, 0.02])
+    cdf = motif_binomial_cdf(events, [0, 0], chances)
+    np.testing.assert_allclose(cdf, [0.9 ** 10 * 0.98 ** 5, 0.9 ** 3 * 0.6 ** 4], rtol=1e-12)
+    np.testing.assert_allclose(cdf, [poisson_binomial_cdf(n, 0, chances) for n in events], rtol=1e-6)
+
+
+def test_motif_binomial_cdf_without_active_motifs():
+    events = np.array([[0, 0, 0], [5, 7, 0], [0, 0, 0]])
+    chances = np.array([[0.2, 0.1, 0.5], [0.0, 0.0, 0.5], [np.nan, 2.0, -1.0]])
+    assert motif_binomial_cdf(events, [0, 0, 0], chances).tolist() == [1.0, 1.0, 1.0]
+
+
+def test_motif_binomial_cdf_invalid_chances():
+    events = np.array([[5, 3], [5, 3], [5, 3], [5, 0]])
+    chances = np.array([[0.1, np.nan], [1.5, 0.1], [0.1, -0.2], [0.1, np.nan]])
+    cdf = motif_binomial_cdf(events, [2, 2, 2, 2], chances)
+    assert np.isnan(cdf[:3]).all()
+    np.testing.assert_allclose(cdf[3], poisson_binomial_cdf([5], 2, [0.1]), rtol=1e-6)
+
+
+def test_no_tilt_at_or_above_the_mean():
+    events = np.array([[10, 10], [10, 10], [10, 10], [10, 10]])
+    chances = np.array([0.2, 0.3])
+    successes = np.array([5, 6, 20, 2]) # the mean is 5
+    theta = tilt_finder(events, np.broadcast_to(chances, events.shape), successes)
+    assert theta[:3].tolist() == [0.0, 0.0, 0.0]
+    assert theta[3] < 0
+    cdf = motif_binomial_cdf(events, successes, chances)
+    np.testing.assert_allclose(cdf, [poisson_binomial_cdf(n, k, chances) for n, k in zip(events, successes)],
+                               rtol=1e-6)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import numpy as np
+import tnseeker.sam_to_insertions as sti
+
+
+def test_insertion_ranges_balance_the_cost():
+    cost = np.array([0, 5, 1, 1, 1, 0, 1, 1, 0, 0])
+    ranges = sti.insertion_ranges(cost, 3)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(cost)
+    assert all(end == start for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]))
+    assert [int(cost[start:end].sum()) for start, end in ranges] == [5, 2, 3]
+    assert sti.insertion_ranges(np.zeros(4, dtype=np.int64), 3) == []
+    assert sti.insertion_ranges(cost, 1) == [(0, len(cost))]
+
+
+def cigar_spans(*cigars):
+    cigar_ends = np.cumsum([0] + [len(cigar) for cigar in cigars], dtype=np.int64)
+    return sti.cigar_reference_span(np.frombuffer("".join(cigars).encode(), dtype=np.uint8),
+                                    cigar_ends).tolist()
+
+
+def test_cigar_reference_span():
+    assert cigar_spans("50M") == [50]
+    assert cigar_spans("10M2I30M") == [40]                # insertions take no reference bases
+    assert cigar_spans("10M3D30M") == [43]                # deletions do
+    assert cigar_spans("10M1000N30M") == [1040]           # and so do skipped regions
+    assert cigar_spans("5S40M", "40M7S", "3H5S40M6S2H") == [40, 40, 40]
+    assert cigar_spans("12=1X12=") == [25]
+    assert cigar_spans("*") == [0]
+    assert cigar_spans("20M", "*", "2S10M4D1I5M") == [20, 0, 19]
+    assert cigar_spans() == []
+
+
+def library_folder(folder, rng, reads=400):
+    ''' A small single ended library: a SAM file over two header contigs and
+    one contig missing from the header, and a gff annotating them. '''
+
+    os.makedirs(folder)
+    lines = ["@HD\tVN:1.0\tSO:unsorted", "@SQ\tSN:chrA\tLN:5000", "@SQ\tSN:chrB\tLN:3000"]
+    for i in range(reads):
+        contig = rng.choice(["chrA", "chrA", "chrB", "chrC"])
+        flag = rng.choice([0, 16, 4])
+        sequence = "".join(rng.choice(list("ACGT"), 30))
+        cigar = rng.choice(["30M", "10M2I18M", "5S25M", "12M3D18M"])
+        lines.append(f"r{i}\t{flag}\t{contig}\t{rng.integers(1, 200)}\t{rng.choice([1, 23, 42])}\t{cigar}"
+                     f"\t*\t0\t0\t{sequence}\t{'I' * 30}\tAS:i:0\tYT:Z:UU")
+    with open(os.path.join(folder, "alignment.sam"), "w") as current:
+        current.write("\n".join(lines) + "\n")
+
+    genes = [("chrA", 20, 90, "+"), ("chrA", 120, 180, "-"), ("chrB", 50, 150, "+"), ("chrC", 1, 100, "-")]
+    with open(os.path.join(folder, "test.gff"), "w") as current:
+        current.write("##gff-version 3\n")
+        for contig, size in (("chrA", 5000), ("chrB", 3000), ("chrC", 2000)):
+            current.write(f"##sequence-region {contig} 1 {size}\n")
+        for i, (contig, start, end, orientation) in enumerate(genes):
+            current.write(f"{contig}\tRefSeq\tgene\t{start}\t{end}\t.\t{orientation}\t.\tID=g{i};Name=gene{i};product=p{i}\n")
+
+
+def test_spilled_runs_match_the_in_memory_count(tmp_path, monkeypatch):
+    rng = np.random.default_rng(1)
+    library_folder(tmp_path / "memory", rng)
+    shutil.copytree(tmp_path / "memory", tmp_path / "spilled")
+
+    # a 1 MB budget holding 16 records per run and merging 3 runs of 4 record blocks at a time
+    monkeypatch.setattr(sti, "record_bytes", (1 << 20) // (2 * 16))
+    monkeypatch.setattr(sti, "merge_fan_in", 3)
+    monkeypatch.setattr(sti, "merge_record_bytes", (1 << 20) // (3 * 4))
+
+    for folder, memory in (("memory", "None"), ("spilled", "1")):
+        path = str(tmp_path / folder)
+        sti.main([path, "test", "SE", "False", "0", "False", "1", os.path.join(path, "test.gff"), "100", "2",
+                  "csv", "False", "parse", memory])
+
+    with open(tmp_path / "memory" / "all_insertions_test.csv", "rb") as memory, \
+         open(tmp_path / "spilled" / "all_insertions_test.csv", "rb") as spilled:
+        assert memory.read() == spilled.read()
+    assert not os.path.exists(tmp_path / "spilled" / "insertion_runs_test")
@@ -5,8 +5,9 @@ import glob
 import numpy as np
 import scipy
 import re
-from tnseeker.extras.possion_binom import PoiBin
+from tnseeker.extras.motif_binomial import motif_binomial_cdf
 from tnseeker.extras.helper_functions import colourful_errors,csv_writer
+from tnseeker.sam_to_insertions import InsertionStore,store_path,insertions_reader
 from scipy.stats import binomtest
 import multiprocessing
 import matplotlib.pyplot as plt
@@ -14,9 +15,11 @@ import sys
 from numba import njit
 import pkg_resources
 import pandas as pd
+import heapq
 import csv
 import subprocess
 from pathlib import Path
+from collections import OrderedDict
 import matplotlib
 matplotlib.use('Agg')
 
@@ -29,6 +32,11 @@ Disclaimer:
     Please don´t judge me too harshly.
 """
 
+# bits of the per base insertion bitfield (gene_insertion_matrix), the 4 
+# high bits holding the border motif code when motif_bit is set
+inserted_bit, plus_bit, minus_bit, motif_bit = 1, 2, 4, 8
+
+
 def inputs(argv):
     ''' The inputs function initializes a global Variables instance with various attributes 
     from a given list of command-line arguments. It sets up parameters for directory, 
@@ -49,6 +57,7 @@ def inputs(argv):
     variables.biggest_gene = 0
 
     variables.cpus = int(argv[9])
+    variables.pool = None  # started on first use, see worker_pool
 
     variables.true_positives = pkg_resources.resource_filename(
         __name__, 'data/true_positives.fasta')
@@ -66,8 +75,13 @@ def path_finder():
             if test1 != -1:
                 return filename
 
-    variables.insertion_file_path = sub_path_finder(
-        variables.directory, '*.csv', "all_insertions")
+    variables.insertion_file_path = store_path(variables.directory, variables.strain)
+    if not InsertionStore.readable(variables.insertion_file_path):
+        variables.insertion_file_path = sub_path_finder(
+            variables.directory, '*.parquet', "all_insertions")
+    if variables.insertion_file_path == None:
+        variables.insertion_file_path = sub_path_finder(
+            variables.directory, '*.csv', "all_insertions")
 
     if variables.annotation_type == "gb":
         extention = '*.gb'
@@ -112,8 +126,9 @@ class Variables():
                  insertion_file_path=None, annotation_file_paths=None, borders_contig={}, orientation_contig={},
                  insertions_contig={}, genome_seq={}, genome_length=0, annotation_contig=None, total_insertions=None,
                  positive_strand_tn_ratio=None, transposon_motiv_count=None, transposon_motiv_freq=None,
-                 chance_motif_tn=None, orientation_contig_plus=None, orientation_contig_neg=None,
-                 subdomain_length=None, pvalue=None):
+                 chance_motif_tn=None,
+                 subdomain_length=None, pvalue=None, motif_index=None, insertion_ranks=None,
+                 pvalue_cache=None):
 
         self.directory = directory
         self.strain = strain
@@ -140,14 +155,15 @@ class Variables():
         self.transposon_motiv_count = transposon_motiv_count or dict()
         self.transposon_motiv_freq = transposon_motiv_freq or dict()
         self.chance_motif_tn = chance_motif_tn or dict()
-        self.orientation_contig_plus = orientation_contig_plus or dict()
-        self.orientation_contig_neg = orientation_contig_neg or dict()
+        self.motif_index = motif_index or dict()
+        self.insertion_ranks = insertion_ranks or dict()
+        self.pvalue_cache = pvalue_cache or PvalueCache()
         self.regex_compile, self.di_motivs = self.motif_compiler()
 
     def normalizer(self,contig):
         motif_genome = np.zeros(16)
         # Counts the entire motifv content of the genome; determining the probability of having an insertion in each motif
-        atcg = count_GC([self.genome_seq[contig]], self.regex_compile)
+        atcg = motif_counter(self.motif_index[contig], 0, len(self.genome_seq[contig]))
         for i, element in enumerate(motif_genome):
             motif_genome[i] = element + atcg[i]
 
@@ -160,37 +176,51 @@ class Variables():
         return np.array([[n] for n in self.chance_motif_tn[contig]])
 
 
-class Significant:
+class PvalueCache:
+
+    ''' The PvalueCache class is a bounded, least recently used store of the 
+    domain p-values (keyed by contig, motif content and insertions of the 
+    domain) and of the insertion orientation binomial tests (keyed by the 
+    insertions of each strand), kept across the domain size iterations, so 
+    that only the values missing from it are computed. Hits and misses are 
+    counted per kind of test (first element of the key). '''
 
-    ''' The Significant class is a container for storing information about a 
-    gene or domain. It initializes attributes such as domain insertions, 
-    p-value, domain length, orientation ratio, orientation p-value, 
-    gene region, and essentiality. Used for the final processing of essentiality'''
+    def __init__(self, size=2**18):
+        self.size = size
+        self.values = OrderedDict()
+        self.hits = {"pvalue": 0, "orientation": 0}
+        self.misses = {"pvalue": 0, "orientation": 0}
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            self.misses[key[0]] += 1
+        else:
+            self.hits[key[0]] += 1
+            self.values.move_to_end(key)
+        return value
 
-    def __init__(self, dom_insert=None, pvalue=None, dom_len=None, ratio_orient=None,
-                 orient_pvalue=None, domain_part=None, essentiality="Non-Essential"):
-        self.dom_insert = dom_insert
-        self.pvalue = pvalue
-        self.dom_len = dom_len
-        self.ratio_orient = ratio_orient
-        self.orient_pvalue = orient_pvalue
-        self.domain_part = domain_part
-        self.essentiality = essentiality
+    def put(self, key, value):
+        self.values[key] = value
+        if len(self.values) > self.size:
+            self.values.popitem(last=False)
+
+    def summary(self):
+        return ", ".join(f"{kind} tests {self.hits[kind]} of {self.hits[kind] + self.misses[kind]} "
+                         f"({self.hits[kind] / max(self.hits[kind] + self.misses[kind], 1) * 100:.1f}%)"
+                         for kind in self.hits)
 
 
 class Gene:
 
     ''' The Gene class is a container for storing information about a gene, 
     including its attributes such as start, end, orientation, domains, identity, 
-    product, contig, and various data related to insertions, GC content, 
-    and domain significance. It initializes these attributes with provided or 
+    product and contig. It initializes these attributes with provided or 
     default values. Used as the first step for storing all processed gene information 
     from the annotation files'''
 
     def __init__(self, gene=None, start=None, end=None, orientation=None, domains=None, identity=None,
-                 product=None, contig=None, matrix=None, domain_insertions_total=None, GC_content=None,
-                 domain_notes=None, motif_seq=None, subdomain_insert_orient_plus=None,
-                 subdomain_insert_orient_neg=None, significant=None):
+                 product=None, contig=None):
 
         self.gene = gene
         self.start = start
@@ -201,14 +231,45 @@ class Gene:
         self.identity = identity
         self.product = product
         self.contig = contig
-        self.gene_insert_matrix = matrix
-        self.domain_insertions_total = domain_insertions_total
-        self.GC_content = GC_content
-        self.domain_notes = domain_notes
-        self.motif_seq = motif_seq
-        self.subdomain_insert_orient_plus = subdomain_insert_orient_plus or dict()
-        self.subdomain_insert_orient_neg = subdomain_insert_orient_neg or dict()
-        self.significant = significant or dict()
+
+
+class GeneTable:
+
+    ''' The GeneTable class holds a chunk of genes in columnar form for the 
+    essentiality evaluation: one array per gene attribute (contig, start, 
+    length and total insertions), the subdomains of all the genes flattened 
+    into arrays (boundaries, motif content, insertions, their orientation and 
+    border motifs), and likewise the domains they are merged into, with the 
+    offsets of the first subdomain and domain of each gene. Genes are referred 
+    to by their basket keys; their names and the domain regions only become 
+    strings when the output table is written. '''
+
+    domain_columns = ("region_start", "region_end", "whole_gene", "dom_insert", "dom_len",
+                      "ratio_orient", "orient_pvalue", "pvalue")
+
+    def __init__(self, basket, keys=None):
+        self.keys = list(basket) if keys is None else list(keys)
+        self.contigs = list(variables.genome_seq)
+        contig_ids = {contig: i for i, contig in enumerate(self.contigs)}
+        self.contig_id = np.array([contig_ids[basket[key].contig] for key in self.keys], dtype=np.int64)
+        self.start = np.array([basket[key].start for key in self.keys], dtype=np.int64)
+        self.length = np.array([basket[key].length for key in self.keys], dtype=np.int64)
+        self.insertions = np.zeros(len(self.keys))
+
+        # subdomains run between consecutive domain boundaries, the last one being the (empty) gene end
+        self.subdomain_offsets = np.concatenate(
+            ([0], np.cumsum([len(basket[key].domains) - 1 for key in self.keys], dtype=np.int64)))
+        self.subdomain_start = np.array([start for key in self.keys for start in basket[key].domains[:-1]], dtype=np.int64)
+        self.subdomain_end = np.array([end for key in self.keys for end in basket[key].domains[1:]], dtype=np.int64)
+
+        self.domain_offsets = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        for column in self.domain_columns:
+            setattr(self, column, np.zeros(0))
+
+    def domain_gene(self):
+        # gene (row of the gene columns) of every domain
+        return np.repeat(np.arange(len(self.keys)), np.diff(self.domain_offsets))
+
 
 def subprocess_cmd(command):
     try:
@@ -335,267 +396,303 @@ def domain_resizer(domain_size_multiplier, basket):
 
 
 def gene_insertion_matrix(basket):
-    ''' The gene_insertion_matrix function generates gene insertion matrices for 
-    each gene in the given basket by considering genome sequence, insertions, 
-    borders, and orientations of transposons. It updates the basket with the 
-    calculated gene insertion matrix for each gene.'''
-
-    def contig_matrix_generator(orient, genome_orient_plus_matrix, genome_orient_neg_matrix,
-                                borders, genome_borders_matrix, inserts, genome_insert_matrix, contig):
-
-        for j, local in enumerate(inserts):
-            local = int(local-1)
-            genome_insert_matrix[local] = 1
-            genome_borders_matrix[local] = borders[j]
-            if orient[j] == "+":
-                genome_orient_plus_matrix[local] = 1
-            else:
-                genome_orient_neg_matrix[local] = 1
-
-        return genome_insert_matrix, genome_borders_matrix, genome_orient_plus_matrix, genome_orient_neg_matrix
+    ''' The gene_insertion_matrix function compiles, for every contig, the 
+    insertions parsed from the insertion file into a single uint8 array with 
+    one bitfield per base: whether it has an insertion, on the + and/or - 
+    strand, and the border motif code (4 bits) of its insertion. It then 
+    ranks the insertions of the contig (insertion_ranker). The basket is 
+    returned unchanged.'''
 
     colourful_errors("INFO",
         "Compiling insertion matrix.")
 
     for contig in variables.genome_seq:
-        contig_size = len(variables.genome_seq[contig])
-        genome_insert_matrix = np.zeros(contig_size, dtype=np.int8)
-        genome_borders_matrix = np.zeros(contig_size, dtype='<U2')
-        genome_orient_plus_matrix = np.zeros(contig_size, dtype=np.int8)
-        genome_orient_neg_matrix = np.zeros(contig_size, dtype=np.int8)
-        variables.orientation_contig_plus[contig] = {}
-        variables.orientation_contig_neg[contig] = {}
+        insertion_bits = np.zeros(len(variables.genome_seq[contig]), dtype=np.uint8)
 
         if len(variables.insertions_contig[contig]) != 0:
-            inserts = np.array(variables.insertions_contig[contig], dtype=int)
-            borders = np.array(variables.borders_contig[contig])
-            orient = np.array(variables.orientation_contig[contig])
-        else:
-            inserts = np.zeros(contig_size, dtype=np.int8)
-            borders = np.zeros(contig_size, dtype='<U2')
-            orient = np.zeros(contig_size, dtype=np.int8)
+            local = np.array(variables.insertions_contig[contig], dtype=np.int64) - 1
+            borders = np.array(variables.borders_contig[contig], dtype=np.uint8)
+            plus = np.array(variables.orientation_contig[contig]) == "+"
 
-        variables.insertions_contig[contig],\
-            variables.borders_contig[contig],\
-            variables.orientation_contig_plus[contig],\
-            variables.orientation_contig_neg[contig] = \
-            contig_matrix_generator(orient, genome_orient_plus_matrix, genome_orient_neg_matrix,
-                                    borders, genome_borders_matrix, inserts, genome_insert_matrix, contig)
+            # a base keeps the border of its last insertion, and the strands of all of them
+            insertion_bits[local] = np.where(borders < 16, motif_bit | (borders << 4), 0)
+            np.bitwise_or.at(insertion_bits, local,
+                             np.where(plus, inserted_bit | plus_bit, inserted_bit | minus_bit).astype(np.uint8))
 
-    for key in basket:
-        start = basket[key].start
-        end = basket[key].end
-        for contig in variables.insertions_contig:
-            # calculating local insertion transposon density in bp windows (size variable)
-            if basket[key].contig == contig:
-                basket[key].gene_insert_matrix = variables.insertions_contig[contig][start-1:end-1]
+        variables.insertions_contig[contig] = insertion_bits
+        variables.borders_contig[contig], variables.orientation_contig[contig] = {}, {}
+        variables.insertion_ranks[contig] = insertion_ranker(contig)
 
     return basket
 
 
-def count_GC(seq, prog):
-    ''' The count_GC function takes a sequence and a list of compiled regex patterns, 
-    then counts the occurrences of each pattern in the sequence. 
-    It returns a list with the counts for each pattern.'''
+def insertion_ranker(contig):
+    ''' The insertion_ranker function returns the positions (0 based) of the 
+    insertions of a contig, in order, with the cumulative counts of the + and 
+    - strand insertions and of the insertions of each border motif over them 
+    (row r counting the insertions before rank r). The insertions of any 
+    domain are then found by two binary searches, and their counts by 
+    differences, whatever the domain size. '''
 
-    result = []
-    for motiv in prog:
-        for insert in seq:
-            result.append(len([m.start() for m in re.finditer(motiv, insert)]))
-    return result
+    positions = np.flatnonzero(variables.insertions_contig[contig] & inserted_bit)
+    insertion_bits = variables.insertions_contig[contig][positions]
 
+    motifs = np.zeros((len(positions), 17), dtype=np.int8)
+    motifs[np.arange(len(positions)), np.where(insertion_bits & motif_bit, insertion_bits >> 4, 16)] = 1
 
-def motiv_compiler(seq, prog):
-    ''' The motiv_compiler function takes a sequence and a list of compiled 
-    regex patterns, then counts the occurrences of each non-empty pattern in 
-    the sequence. It returns an array containing the counts for each pattern.'''
+    return positions, \
+        cumulative((insertion_bits & plus_bit) != 0), \
+        cumulative((insertion_bits & minus_bit) != 0), \
+        cumulative(motifs[:, :16])
 
-    motiv_inbox = np.zeros(16)
-    for s, insertion in enumerate(seq):
-        if insertion != "":
-            for i, motiv in enumerate(prog):
-                if [m.start() for m in re.finditer(motiv, insertion)] != []:
-                    motiv_inbox[i] = motiv_inbox[i] + 1
-                    break
-    return motiv_inbox
 
+def cumulative(counts, dtype=np.int64):
+    ''' Returns the cumulative sums of counts along its first axis, with a 
+    leading row of zeros: the sum of rows [first:last] is then the difference 
+    of rows last and first. '''
 
-def poisson_binomial(events, motiv_inbox, tn_chance):
-    ''' The poisson_binomial function calculates the Poisson binomial 
-    cumulative distribution function for a given set of events, motif occurrences, 
-    and transposon insertion chances. It returns the absolute value of the 
-    calculated p-value.'''
-
-    def chance_matrix(events, motiv_inbox, tn_chance):
-        p_effective = np.array(())
-        for i, (chance, number) in enumerate(zip(tn_chance, events)):
-            for i in range(number):
-                p_effective = np.append(p_effective, chance)
-        sucess = np.sum(motiv_inbox)
-        # due to insertion redundancy (+ and - strand), sometimes there are more insertions than bp
-        if sucess > np.sum(events):
-            sucess = np.sum(events)
-        return sucess, p_effective
-    
-
-    sucess, p_effective = chance_matrix(events, motiv_inbox, tn_chance)
-    pb = PoiBin(p_effective)
-
-    # in some cases of highly biassed transposon, essential genes can be so significant that p < 0 (probably some bug on the poisson code)
-    return abs(pb.cdf(int(sucess)))
+    return np.concatenate((np.zeros((1,) + counts.shape[1:], dtype=dtype),
+                           np.cumsum(counts, axis=0, dtype=dtype)))
 
 
-def essentials(chunk, variables):
-    ''' The essentials function takes a chunk of genes and related variables as 
-    input and analyzes each gene for essential domains based on various criteria 
-    such as insertion patterns, orientation ratios, and statistical significance 
-    (p-values). The function works as follows:
-
-        1. Initializes data structures to store essential domain information for 
-        each gene.
+def motif_indexer(seq):
+    ''' The motif_indexer function 2-bit encodes a contig sequence (A, T, C, G, 
+    in the order of the di_motivs, any other base breaking the dinucleotides) 
+    and returns its cumulative dinucleotide count array: row k holds the 
+    counts of the 16 dinucleotides starting before position k, so that the 
+    motif content of any region is the difference of two rows. '''
 
-        2. Processes each gene in the chunk, identifying domains with no insertions 
-        or specific insertion patterns.
+    encoder = np.full(256, 4, dtype=np.uint8)
+    for code, base in enumerate("ATCG"):
+        encoder[ord(base)] = encoder[ord(base.lower())] = code
+    bases = encoder[np.frombuffer(seq.encode("ascii", errors="replace"), dtype=np.uint8)]
 
-        3. For each gene, it evaluates the ratio of insertions with positive and 
-        negative orientations and calculates a p-value using a binomial test to 
-        determine the significance of the ratio.
+    dinucleotides = bases[:-1] * 4 + bases[1:]
+    dinucleotides[(bases[:-1] == 4) | (bases[1:] == 4)] = 16 # not a dinucleotide
 
-        4. If the domain spans the entire gene or if there are sub-domains within 
-        the gene, it calculates essentiality metrics for each domain or sub-domain.
+    index = np.zeros((max(len(bases), 1), 16), dtype=np.int32)
+    for motif in range(16):
+        np.cumsum(dinucleotides == motif, out=index[1:, motif])
+    return index
 
-        5. It calls the domain_maker function to update the essentiality 
-        information for each domain of the gene, such as p-value, number of insertions, 
-        domain length, orientation ratio, and orientation p-value.
 
-        6. The function iterates through all the genes in the chunk, updating 
-        their essentiality information.
-
-        7. After processing all the genes in the chunk, the function returns the 
-        updated chunk with essentiality information for each gene.'''
-
-    def ratio_insertions(p, subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster):
-        total_orientation = subdomain_insert_orient_pos_cluster + \
-            subdomain_insert_orient_neg_cluster
-        if total_orientation != 0:
-            ratio_orientation = subdomain_insert_orient_pos_cluster / \
-                total_orientation  # zero means no neg insertions, only positive
-            pvalue = binomtest(subdomain_insert_orient_pos_cluster,
-                               total_orientation, p, alternative='two-sided').pvalue
-        else:
-            ratio_orientation, pvalue = "N/A", "N/A"
-        return ratio_orientation, pvalue
-
-    def domain_maker(chunk, key, domain, domain_motivs, motiv_insertions, subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster):
-        ratio_orientation, orient_pvalue = ratio_insertions(variables.positive_strand_tn_ratio,
-                                                            subdomain_insert_orient_neg_cluster,
-                                                            subdomain_insert_orient_pos_cluster)
-        chunk[key].significant[domain] = Significant()
-        chunk[key].significant[domain].dom_insert = sum(motiv_insertions)
-        chunk[key].significant[domain].dom_len = sum(domain_motivs)
-        chunk[key].significant[domain].ratio_orient = ratio_orientation
-        chunk[key].significant[domain].orient_pvalue = orient_pvalue
-        chunk[key].significant[domain].domain_part = domain
-        try:
-            chunk[key].significant[domain].pvalue = poisson_binomial(
-                domain_motivs, motiv_insertions, variables.chance_motif_tn[chunk[key].contig])  # / (1/sum(domain_motivs))
-        except Exception as e:
-            colourful_errors("WARNING",
-                f"Due to {e}, {key} could not be evaluated.")
-            chunk[key].significant[domain].pvalue = 1
-        return chunk
+def motif_counter(index, start, end):
+    ''' The motif_counter function returns the dinucleotide counts of the 
+    sequence slice [start:end] of a contig, from its motif_indexer array, 
+    in the order of the di_motivs. '''
 
-    # annexes all the genes which fit the criteria of essentiality
-    for key in chunk:
+    start, end, _ = slice(start, end).indices(len(index))
+    if end - 1 <= start:
+        return np.zeros(16, dtype=np.int64)
+    return (index[end - 1] - index[start]).astype(np.int64)
 
-        chunk[key].significant = {}  # clears any overlapping dictionaries
-        # total number of insertions in gene
-        insertions = chunk[key].domain_insertions_total
-        domains = chunk[key].domains[:-1]
-        start = chunk[key].start
 
-        if sum(insertions) == 0:  # gene has no insertions
-
-            # number of each motif in the gene (sum is gene lenght)
-            domain_motivs = np.sum(chunk[key].GC_content, axis=0)*2
-            # number of each insertion per motif in the gene (sum is total insertions)
-            motiv_insertions = np.sum(chunk[key].motif_seq, axis=0)
-
-            chunk = domain_maker(chunk, key, "whole gene",
-                                 domain_motivs, motiv_insertions, 0, 0)
-
-        else:
+def motiv_compiler(seq, prog):
+    ''' The motiv_compiler function takes a sequence and a list of compiled 
+    regex patterns, then counts the occurrences of each non-empty pattern in 
+    the sequence. It returns an array containing the counts for each pattern.'''
 
-            sub_domain_cluster, sub_insertions_cluster, domain_part = [], [], []
-            subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster = 0, 0
-            insertions = np.append(insertions, 1)  # avoid overflow
-
-            for i, (domain_insert, sub_domain, sub_insertions, sub_name, neg, pos) \
-                in enumerate(zip(insertions, chunk[key].GC_content, chunk[key].motif_seq,
-                                 domains, chunk[key].subdomain_insert_orient_neg.values(
-                ),
-                    chunk[key].subdomain_insert_orient_plus.values())):
-
-                subdomain_insert_orient_neg_cluster += neg
-                subdomain_insert_orient_pos_cluster += pos
-                sub_domain_cluster.append(sub_domain)
-                sub_insertions_cluster.append(sub_insertions)
-
-                # if there is only one domains in the gene
-                if sum(sub_domain) == chunk[key].length:
-                    chunk = domain_maker(chunk, key, "whole gene", sub_domain, sub_insertions,
-                                         subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster)
+    motiv_inbox = np.zeros(16)
+    for s, insertion in enumerate(seq):
+        if insertion != "":
+            for i, motiv in enumerate(prog):
+                if [m.start() for m in re.finditer(motiv, insertion)] != []:
+                    motiv_inbox[i] = motiv_inbox[i] + 1
                     break
+    return motiv_inbox
 
-                # if the domain is the last in the gene.
-                if i == len(domains)-1:
-
-                    sub_domain_cluster = np.sum(sub_domain_cluster, axis=0)
-                    sub_insertions_cluster = np.sum(
-                        sub_insertions_cluster, axis=0)
-
-                    if domains[i]-domain_part[0] == chunk[key].length:
-                        domain = "whole gene"
-
-                    else:
-                        domain = str(domain_part[0]-start) + \
-                            " to " + str(domains[-1]-start)
 
-                    chunk = domain_maker(chunk, key, domain, sub_domain_cluster, sub_insertions_cluster,
-                                         subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster)
-                    subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster = 0, 0
+def border_coder(borders, prog):
+    ''' The border_coder function returns the motif code of each transposon 
+    border sequence: the index of the di_motiv it is counted under by 
+    motiv_compiler, 16 when there is none (empty or non ATCG borders). 
+    Borders are the two bases after the transposon, so there are only a few 
+    distinct ones, each classified once and looked up for all the others. '''
 
-                # if the next domain is basically a continuation of the last (also with/out insertions), and it isnt the last domain of the gene
-                elif (((domain_insert == 0) & (insertions[i+1] == 0)) or
-                      ((domain_insert != 0) & (insertions[i+1] != 0))) and (i < len(domains)-1):
-                    domain_part.append(sub_name)
+    borders, codes = np.unique(np.asarray(borders, dtype=str), return_inverse=True)
+    lookup = np.full(len(borders), 16, dtype=np.int8)
+    for i, border in enumerate(borders):
+        motiv_inbox = motiv_compiler([border], prog)
+        if motiv_inbox.any():
+            lookup[i] = np.argmax(motiv_inbox)
+    return lookup[codes.reshape(-1)]
 
-                # if the next domain is different from the previous(domain appending consideration will break), and also not the last domain in the gene
-                elif (((domain_insert == 0) & (insertions[i+1] != 0)) or
-                      ((domain_insert != 0) & (insertions[i+1] == 0))) and (i < len(domains)-1):
 
-                    domain_part.append(sub_name)
+def motif_histogram(codes):
+    ''' Counts the insertions of each of the 16 di_motivs from their border 
+    motif codes, the same vector motiv_compiler returns for the borders. '''
 
-                    sub_domain_cluster = np.sum(sub_domain_cluster, axis=0)
-                    sub_insertions_cluster = np.sum(
-                        sub_insertions_cluster, axis=0)
+    return np.bincount(codes, minlength=17)[:16].astype(np.float64)
 
-                    if domains[i+1]-domain_part[0] == chunk[key].length:
-                        domain = "whole gene"
-                    else:
-                        domain = str(domain_part[0]-start) + \
-                            " to " + str(domains[i+1]-start)
 
-                    chunk = domain_maker(chunk, key, domain, sub_domain_cluster, sub_insertions_cluster,
-                                         subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster)
+def poisson_binomial(events, motiv_inbox, tn_chance):
+    ''' The poisson_binomial function calculates the Poisson binomial 
+    cumulative distribution function for a batch of domains, given their 
+    motif occurrences (events), the motifs of their insertions and the 
+    transposon insertion chance of each motif. As every base of a motif 
+    shares the same chance, the insertions of a domain are a sum of one 
+    binomial per motif (see motif_binomial_cdf). It returns the p-value of 
+    every domain, nan for the domains that could not be evaluated.'''
+
+    sucess = np.sum(motiv_inbox, axis=1)
+    # due to insertion redundancy (+ and - strand), sometimes there are more insertions than bp
+    sucess = np.minimum(sucess, np.sum(events, axis=1))
+
+    return motif_binomial_cdf(events, sucess.astype(np.int64), tn_chance)
+
+
+def multi_poisson_binomial(events, motiv_inbox, tn_chance):
+    ''' The multi_poisson_binomial function computes poisson_binomial for a 
+    batch of domains on the worker pool. The cost of a domain grows with the 
+    length of its distribution (its bases of each motif, up to its number of 
+    insertions), on top of a fixed cost, mostly for the domains with 
+    insertions. The domains are grouped, heaviest first, into work units of 
+    about the same cost, which are handed out one at a time to whichever 
+    worker is idle, so that no worker is left alone with the largest domains. '''
+
+    sucess = np.minimum(np.sum(motiv_inbox, axis=1), np.sum(events, axis=1))
+    weights = np.sum(np.minimum(events, sucess[:, None]), axis=1) + np.where(sucess > 0, 300, 30)
+    units = min(variables.cpus * 4, len(weights))
+    if (variables.cpus == 1) or (units < 2):
+        return poisson_binomial(events, motiv_inbox, tn_chance)
+
+    order = np.argsort(-weights, kind="stable")
+    cumulated = np.cumsum(weights[order])
+    bounds = np.unique(np.searchsorted(cumulated, cumulated[-1] / units * np.arange(1, units)))
+    units = [unit for unit in np.split(order, bounds) if len(unit) != 0]
+
+    pvalues = np.empty(len(weights))
+    for unit, unit_pvalues in zip(units, worker_pool().starmap(
+            poisson_binomial, [(events[unit], motiv_inbox[unit], tn_chance[unit]) for unit in units], chunksize=1)):
+        pvalues[unit] = unit_pvalues
+    return pvalues
+
+
+@njit("(int64[:], int64[:], int64[:], int64[:], int64[:])", cache=True)
+def domain_merger(subdomain_offsets, subdomain_start, insertions, gene_start, gene_length):
+    ''' The domain_merger function merges the consecutive subdomains of every 
+    gene that all have insertions, or all have none, into domains. A gene 
+    without any insertions is a single, whole gene, domain. It returns flat 
+    arrays with, for every domain, its gene, its first and last (excluded) 
+    subdomains, its region (relative to the gene start) and whether it spans 
+    the whole gene. '''
+
+    size = len(subdomain_start) + len(gene_start)
+    gene = np.empty(size, dtype=np.int64)
+    first = np.empty(size, dtype=np.int64)
+    last = np.empty(size, dtype=np.int64)
+    region_start = np.empty(size, dtype=np.int64)
+    region_end = np.empty(size, dtype=np.int64)
+    whole_gene = np.empty(size, dtype=np.bool_)
+
+    d = 0
+    for g in range(len(gene_start)):
+        a, b = subdomain_offsets[g], subdomain_offsets[g + 1]  # subdomain b-1 is the gene end
+        inserted = 0
+        for j in range(a, b - 1):
+            inserted += insertions[j]
+
+        if inserted == 0:
+            gene[d], first[d], last[d] = g, a, b
+            region_start[d], region_end[d], whole_gene[d] = 0, gene_length[g], True
+            d += 1
+            continue
+
+        run = a
+        for j in range(a, b - 1):
+            empty = insertions[j] == 0
+            next_empty = (j + 2 < b) and (insertions[j + 1] == 0)
+            # a domain ends where the next subdomain differs, or at the gene end
+            if (empty != next_empty) or (j + 2 == b):
+                gene[d], first[d], last[d] = g, run, j + 1
+                region_start[d] = subdomain_start[run] - gene_start[g]
+                region_end[d] = subdomain_start[j + 1] - gene_start[g]
+                whole_gene[d] = region_end[d] - region_start[d] == gene_length[g]
+                d += 1
+                run = j + 1
+
+    return gene[:d], first[:d], last[:d], region_start[:d], region_end[:d], whole_gene[:d]
+
+
+def essentials(table, variables):
+    ''' The essentials function takes a table of genes, with their annotated 
+    subdomains, and evaluates the essentiality of their domains based on 
+    insertion patterns, orientation ratios and statistical significance 
+    (p-values). The function works as follows:
 
-                    domain_part = [domains[i+1]]
-                    sub_domain_cluster, sub_insertions_cluster = [], []
-                    subdomain_insert_orient_neg_cluster, subdomain_insert_orient_pos_cluster = 0, 0
+        1. Merges the consecutive subdomains of each gene with and without 
+        insertions into domains (domain_merger). A gene without insertions 
+        is evaluated as a whole.
+
+        2. Sums the motif content, the insertions per motif and the insertion 
+        orientations of every domain, from the cumulative subdomain counts.
+
+        3. For each domain with insertions, it evaluates the ratio of insertions 
+        with positive and negative orientations and calculates a p-value using 
+        a binomial test to determine the significance of the ratio.
+
+        4. Computes the p-value of the insertions of every domain, given its 
+        motif content (poisson_binomial). The p-values missing from the cache 
+        are computed all at once, on the worker pool.
+
+        5. Returns the table with the domain columns filled in.'''
+
+    gene, first, last, table.region_start, table.region_end, table.whole_gene = domain_merger(
+        table.subdomain_offsets, table.subdomain_start, table.subdomain_insertions, table.start, table.length)
+    table.domain_offsets = np.searchsorted(gene, np.arange(len(table.keys) + 1)).astype(np.int64)
+
+    GC_content = cumulative(table.GC_content)
+    domain_motivs = GC_content[last] - GC_content[first]
+    domain_motivs[table.insertions[gene] == 0] *= 2  # genes without insertions count their motifs twice
+    motif_seq = cumulative(table.motif_seq, np.float64)
+    motiv_insertions = motif_seq[last] - motif_seq[first]
+    orient_plus, orient_neg = cumulative(table.orient_plus), cumulative(table.orient_neg)
+    orient_plus = orient_plus[last] - orient_plus[first]
+    orient_total = orient_plus + orient_neg[last] - orient_neg[first]
+
+    table.dom_insert = motiv_insertions.sum(axis=1)
+    table.dom_len = domain_motivs.sum(axis=1)
+
+    table.ratio_orient = np.full(len(gene), np.nan)  # no insertions to orient
+    table.orient_pvalue = np.full(len(gene), np.nan)
+    for d in np.flatnonzero(orient_total != 0):
+        table.ratio_orient[d] = orient_plus[d] / orient_total[d]  # zero means no neg insertions, only positive
+        cache_key = ("orientation", int(orient_plus[d]), int(orient_total[d]))
+        pvalue = variables.pvalue_cache.get(cache_key)
+        if pvalue is None:
+            pvalue = binomtest(int(orient_plus[d]), int(orient_total[d]), 
+                               variables.positive_strand_tn_ratio, alternative='two-sided').pvalue
+            variables.pvalue_cache.put(cache_key, pvalue)
+        table.orient_pvalue[d] = pvalue
+
+    # domains already tested (same contig, motif content and insertions) are taken from the cache
+    contigs = [table.contigs[contig_id] for contig_id in table.contig_id[gene]]
+    cache_keys = [("pvalue", contig, motivs.tobytes(), int(insertions)) for contig, motivs, insertions
+                  in zip(contigs, domain_motivs, np.minimum(motiv_insertions.sum(axis=1), domain_motivs.sum(axis=1)))]
+    pvalues = [variables.pvalue_cache.get(cache_key) for cache_key in cache_keys]
+
+    missing = {}
+    for d, (cache_key, pvalue) in enumerate(zip(cache_keys, pvalues)):
+        if pvalue is None:
+            missing.setdefault(cache_key, d)
+    if missing != {}:
+        rows = list(missing.values())
+        tn_chance = np.array([np.ravel(variables.chance_motif_tn[contigs[d]]) for d in rows])
+        missing = dict(zip(missing, multi_poisson_binomial(domain_motivs[rows], motiv_insertions[rows], tn_chance)))
+        for cache_key, pvalue in missing.items():
+            variables.pvalue_cache.put(cache_key, pvalue)
+
+    table.pvalue = np.ones(len(gene))
+    for d, (cache_key, pvalue) in enumerate(zip(cache_keys, pvalues)):
+        if pvalue is None:
+            pvalue = missing[cache_key]
+        if np.isnan(pvalue):
+            colourful_errors("WARNING",
+                f"Due to invalid motif insertion probabilities, {table.keys[gene[d]]} could not be evaluated.")
+            pvalue = 1
+        table.pvalue[d] = pvalue
 
-                if domain_part[0]-start == domains[-1]-start:
-                    break
-    return chunk
+    return table
 
 
 @njit
@@ -627,48 +724,6 @@ def pvaluing_jit(pvaluing_array, pvalue_bol, sig_thresh, i):
     return remove_signal, pvaluing_array
 
 
-def pvaluing(names, pvalues_list, pvaluing_array, pvalue, variables, baseline_essentials, baseline_non_essentials):
-    ''' The pvaluing function takes gene names, p-values, and other relevant 
-    inputs to analyze gene essentiality. It applies FDR correction using the 
-    Benjamini-Hochberg procedure to account for multiple testing. 
-    The function then updates sets of essential and non-essential genes, 
-    as well as rejected baselines for both categories. Finally, it returns 
-    the processed p-value array and information about the essential and 
-    non-essential genes, along with their respective rejected baselines.'''
-
-    strain_existent_essentials = set()
-    strain_existent_nonessentials = set()
-    rejected_baseline_essentials = set()
-    rejected_baseline_nonessentials = set()
-
-    fdr = statsmodels.stats.multitest.multipletests(
-        pvalues_list, pvalue, "fdr_bh")  # multitest correction, fdr_bh
-
-    for i, (name, entry) in enumerate(zip(names, pvaluing_array)):
-        remove_signal, pvaluing_array = pvaluing_jit(
-            pvaluing_array, fdr[0], fdr[-1], i)
-
-        if remove_signal == 1:
-            if (name in baseline_essentials) & (len(baseline_essentials) >= 30):
-                baseline_essentials.remove(name)
-            elif (name in baseline_non_essentials) & (len(baseline_non_essentials) >= 30):
-                baseline_non_essentials.remove(name)
-
-        else:
-            if name in baseline_essentials:
-                strain_existent_essentials.add(name)
-                if fdr[0][i] == False:
-                    rejected_baseline_essentials.add(name)
-
-            elif name in baseline_non_essentials:
-                strain_existent_nonessentials.add(name)
-                if fdr[0][i] == True:
-                    rejected_baseline_nonessentials.add(name)
-
-    return pvaluing_array, strain_existent_essentials, fdr[3], rejected_baseline_essentials, \
-        rejected_baseline_nonessentials, strain_existent_nonessentials
-
-
 def basket_storage():
     ''' The basket_storage function forwards the program to the correct annotation
     parser function based on the input annotation file format.'''
@@ -890,7 +945,7 @@ def insertions_parser(startup=True):
         4. Prints the transposon insertion frequency for each leading strand motif.'''
 
     # new code
-    insertions_df = pd.read_csv(variables.insertion_file_path)
+    insertions_df = insertions_reader(variables.insertion_file_path)
     insertions_df["unique"] = insertions_df["#Contig"] + \
         insertions_df["position"].astype(str)+insertions_df["Orientation"]
     insertions_df.drop_duplicates(subset=['unique'], inplace=True)
@@ -912,10 +967,14 @@ def insertions_parser(startup=True):
     orient_pos = len([n for n in insertions_df["Orientation"] if n == "+"])
     variables.positive_strand_tn_ratio = orient_pos / variables.total_insertions
 
+    # borders are kept as their motif codes
+    insertions_df["motif"] = border_coder(insertions_df["Transposon Border Sequence"], 
+                                          variables.regex_compile)
+
     for (contig, insertion, orientation, border) in zip(insertions_df["#Contig"],
                                                         insertions_df["position"],
                                                         insertions_df["Orientation"],
-                                                        insertions_df["Transposon Border Sequence"]):
+                                                        insertions_df["motif"]):
 
         if variables.insertions_contig[contig] == {}:
             variables.borders_contig[contig] = [border]
@@ -929,10 +988,8 @@ def insertions_parser(startup=True):
     
     contig_df = insertions_df.groupby("#Contig")
     for (contig,contig_df) in contig_df:
-        borders = contig_df['Transposon Border Sequence'].tolist()
-        
-        variables.transposon_motiv_count[contig] = motiv_compiler(
-            borders, variables.regex_compile)
+        variables.transposon_motiv_count[contig] = motif_histogram(
+            contig_df["motif"].to_numpy())
         total = sum(variables.transposon_motiv_count[contig]) #total number of insertions in contig
 
         variables.transposon_motiv_freq[contig] = np.zeros(
@@ -945,224 +1002,248 @@ def insertions_parser(startup=True):
         # calculating the insertion frequency
         variables.chance_motif_tn[contig] = variables.normalizer(contig)
     
-def insertion_annotater(chunk, variables):
-    ''' The function insertion_annotater takes a dictionary chunk of gene 
-    objects and a set of variables and annotates each gene object with 
-    various insertion-related information, such as the number of insertions 
-    and their orientation within each subdomain of the gene, the GC content of 
-    each subdomain, and the transposon motif content of each subdomain. T
-    he function returns the annotated chunk. '''
-
-    for key in chunk:
-
-        chunk[key].subdomain_insert_orient_neg, chunk[key].subdomain_insert_orient_plus = {
-        }, {}  # clear past values
-        subdomain_insertions, subdomain_insert_seq = {}, {}
-
-        GC_content, domains = [], []
-        # first element is start position of gene
-
-        for i, subdomain in enumerate(chunk[key].domains[:-1]):
-            GC_content.append(np.array(count_GC([variables.genome_seq[chunk[key].contig][subdomain:chunk[key].domains[i+1]+1]],
-                                                variables.regex_compile)))
-            domains.append(subdomain)
-            # every domain needs an entry, even if empty
-            subdomain_insert_seq[subdomain] = [""]
-            chunk[key].subdomain_insert_orient_plus[subdomain] = 0
-            chunk[key].subdomain_insert_orient_neg[subdomain] = 0
-
-        chunk[key].domain_notes = domains
-        chunk[key].GC_content = GC_content
-        # pinning all the insertions to their gene domains
-
-        for i, subdomain in enumerate(chunk[key].domains[:-2]):
-            domain_start = subdomain-chunk[key].start
-            domain_end = chunk[key].domains[i+1]-chunk[key].start
-            subdomain_insertions[subdomain] = sum(
-                chunk[key].gene_insert_matrix[domain_start:domain_end])
-            if subdomain_insertions[subdomain] != 0:
-                for j in range(subdomain-1, chunk[key].domains[i+1]-1):
-                    border = variables.borders_contig[chunk[key].contig][j]
-                    insert = variables.insertions_contig[chunk[key].contig][j]
-                    if insert == 1:
-                        subdomain_insert_seq[subdomain] = subdomain_insert_seq[subdomain] + [
-                            border]
-                        # positive insertion
-                        if variables.orientation_contig_plus[chunk[key].contig][j] == 1:
-                            chunk[key].subdomain_insert_orient_plus[subdomain] += 1
-                        # negative insertion
-                        if variables.orientation_contig_neg[chunk[key].contig][j] == 1:
-                            chunk[key].subdomain_insert_orient_neg[subdomain] += 1
-
-        # Transposon motif content in each domain (alwyas 16, corresponding to the dinucleotide combo)
-        if subdomain_insert_seq != {}:
-            motif_seq = []
-            for key1, value in sorted(subdomain_insert_seq.items()):
-                motif_seq.append(motiv_compiler(
-                    value, variables.regex_compile))
-            chunk[key].motif_seq = motif_seq
-
-        else:
-            chunk[key].motif_seq = np.zeros(16)
-
-        chunk[key].domain_insertions_total = np.zeros(
-            len(subdomain_insertions))
-        for i, (key1, value) in enumerate(sorted(subdomain_insertions.items())):
-            chunk[key].domain_insertions_total[i] = value
-
-    chunk = essentials(chunk, variables)
-
-    return chunk
+def worker_pool():
+    ''' Returns the pool of worker processes of the run. It is started on 
+    first use and reused until main closes it. Only the motif binomial 
+    p-values (multi_poisson_binomial) are computed on it: the domain 
+    annotation (domain_statistics) is vectorized and runs in the parent. The 
+    workers hold no run data, every task carrying its own inputs. '''
+
+    if variables.pool is None:
+        variables.pool = multiprocessing.Pool(processes = variables.cpus)
+    return variables.pool
+
+def domain_statistics(table):
+    ''' The domain_statistics function annotates all the subdomains of a table 
+    of genes at once, from the contig motif indexes and insertion ranks: the 
+    dinucleotide content of each subdomain (GC_content), the number of 
+    insertions, their orientation and their border motifs, and the total 
+    insertions of every gene. The last subdomain of a gene (its end) holds 
+    no insertions. '''
+
+    starts, ends, offsets = table.subdomain_start, table.subdomain_end, table.subdomain_offsets
+    contigs = np.repeat(table.contig_id, np.diff(offsets))
+
+    GC_content = np.zeros((len(starts), 16), dtype=np.int64)
+    insertions = np.zeros(len(starts), dtype=np.int64)
+    orient_plus = np.zeros(len(starts), dtype=np.int64)
+    orient_neg = np.zeros(len(starts), dtype=np.int64)
+    motif_seq = np.zeros((len(starts), 16))
+
+    for contig_id in np.unique(contigs):
+        domain = np.flatnonzero(contigs == contig_id)
+        contig = table.contigs[contig_id]
+
+        # sequence [start:end+1] of the subdomain, both rows kept within the index (as motif_counter)
+        index = variables.motif_index[contig]
+        first = np.clip(starts[domain], 0, len(index) - 1)
+        last = np.clip(ends[domain] + 1, 1, len(index)) - 1
+        GC_content[domain] = np.where((last > first)[:, None], index[last] - index[first], 0)
+
+        # insertions at the (0 based) positions [start-1:end-1] of the subdomain
+        positions, plus, neg, motifs = variables.insertion_ranks[contig]
+        first = np.searchsorted(positions, starts[domain] - 1)
+        last = np.maximum(np.searchsorted(positions, ends[domain] - 1), first)
+        insertions[domain] = last - first
+        orient_plus[domain] = plus[last] - plus[first]
+        orient_neg[domain] = neg[last] - neg[first]
+        motif_seq[domain] = motifs[last] - motifs[first]
+
+    gene_end = offsets[1:][offsets[1:] > offsets[:-1]] - 1
+    insertions[gene_end], orient_plus[gene_end], orient_neg[gene_end], motif_seq[gene_end] = 0, 0, 0, 0
+
+    table.GC_content, table.motif_seq = GC_content, motif_seq
+    table.subdomain_insertions, table.orient_plus, table.orient_neg = insertions, orient_plus, orient_neg
+    insertions = cumulative(insertions)
+    table.insertions = (insertions[offsets[1:]] - insertions[offsets[:-1]]).astype(np.float64)
+
+    return table
 
 
 def multi_annotater(basket):
-    ''' The function insertion_annotater takes a dictionary chunk of gene 
-    objects and a set of variables and annotates each gene object with 
-    various insertion-related information, such as the number of insertions 
-    and their orientation within each subdomain of the gene, the GC content of 
-    each subdomain, and the transposon motif content of each subdomain. T
-    he function returns the annotated chunk. '''
-
-    # divides the dictionary keys into smaller blocks that can be efficiently be multiprocessed
-    divider = len(basket)//variables.cpus
-    return_list = [dict() for i in range(variables.cpus)]
-    i, list_iter = 0, 0
-    for k in basket:
-        if i < variables.cpus:
-            return_list[i][k] = basket[k]
-
-        if i == variables.cpus:  # odd number split will be distributed equally
-            list_iter += 1
-            return_list[list_iter][k] = basket[k]
-
-        elif len(return_list[i]) >= divider:
-            i += 1
-
-    result_objs = []
-    pool = multiprocessing.Pool(processes = variables.cpus)
-
-    for chunk in return_list:
-        result = pool.apply_async(
-            insertion_annotater, args=((chunk, variables)))
-        result_objs.append(result)
-
-    pool.close()
-    pool.join()
-    result = [result.get() for result in result_objs]
-    # demultiplexing the results
-    for subresult in result:
-        for key in basket:
-            if key in subresult:
-                basket[key] = subresult[key]
-
-    return basket
-
-
-def pvalue_iteration(names, pvalues_list, pvaluing_array, pvalue, pvalue_listing, euclidean_points, variables):
-    ''' This function performs a p-value iteration analysis to determine the 
-    true positive rate (TPR) and specificity of a given test at different 
-    p-value thresholds. It calls the function 'pvaluing' to calculate the 
-    number of true positives, false negatives, true negatives and false 
-    positives at a given p-value threshold. It then calculates the TPR and 
-    specificity from these values and appends them, along with the p-value 
-    threshold, to two lists. Finally, it returns these two lists. '''
+    ''' The function multi_annotater builds the GeneTable of a dictionary of 
+    gene objects, annotates the subdomains of each gene with their insertions, 
+    orientation, GC content and transposon motif content (domain_statistics), 
+    and evaluates the essentiality of their domains, the p-values missing 
+    from the cache being computed on the worker pool. The function returns 
+    the domains of all the genes, in the order of the basket. '''
+
+    table = GeneTable(basket)
+    table = domain_statistics(table)
+    return essentials(table, variables)
+
+
+def bh_adjusted(pvalues):
+    ''' The bh_adjusted function returns the Benjamini-Hochberg adjusted 
+    p-values (as multipletests fdr_bh): a domain is rejected at every 
+    threshold from its adjusted p-value on. '''
+
+    order = np.argsort(pvalues)
+    ranked = pvalues[order] / (np.arange(1, len(pvalues) + 1) / float(len(pvalues)))
+    adjusted = np.empty(len(pvalues))
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return adjusted
+
+
+def gene_coverage(gene, start, end, size):
+    ''' The gene_coverage function counts, at every threshold index below 
+    size, the genes with at least one of their [start, end) intervals over 
+    it. The intervals of each gene are sorted and merged while they overlap, 
+    and the counts are cumulated from the merged borders. '''
+
+    keep = start < end
+    gene, start, end = gene[keep], start[keep], end[keep]
+    order = np.lexsort((start, gene))
+    gene, start, end = gene[order], start[order], end[order]
+
+    shift = gene * (size + 1)  # keeps the running maximum within each gene
+    reach = np.maximum.accumulate(end + shift) - shift
+    opening = np.ones(len(gene), dtype=bool)
+    opening[1:] = (gene[1:] != gene[:-1]) | (start[1:] > reach[:-1])
+    closing = np.roll(opening, -1)  # the last interval of a merge
+
+    borders = np.bincount(start[opening], minlength=size + 1) - np.bincount(reach[closing], minlength=size + 1)
+    return np.cumsum(borders)[:size]
+
+
+def benchmark_counts(genes, too_small_until, rejected_from, dropped, size, wrong_if_rejected):
+    ''' The benchmark_counts function counts, at every index of the ascending 
+    thresholds, the genes of a benchmark set with assayed domains, and those 
+    with an assayed domain wrongly called (rejected, or not, as 
+    wrong_if_rejected). A domain is rejected from the index rejected_from on, 
+    and too small for assaying below too_small_until. A gene with a too small 
+    domain is dropped from the set, with the domains from its first too small 
+    one on, when fewer than dropped genes before it also have one. '''
+
+    # genes in the order of their first domain, and their domains in order
+    _, first, gene = np.unique(genes, return_index=True, return_inverse=True)
+    gene = np.argsort(np.argsort(first))[gene]
+    order = np.argsort(gene, kind='stable')
+    gene, too_small_until, rejected_from = gene[order], too_small_until[order], rejected_from[order]
+
+    # a domain follows a too small domain of its gene below after_too_small
+    shift = gene * (size + 1)
+    after_too_small = np.maximum.accumulate(too_small_until + shift) - shift
+    gene_too_small_until = np.zeros(len(first), dtype=np.int64)
+    np.maximum.at(gene_too_small_until, gene, too_small_until)
+
+    # a gene is dropped from dropping_from on, while fewer than dropped genes before 
+    # it have a too small domain, i.e. above the dropped-th largest of their indexes
+    dropping_from = np.full(len(first), size, dtype=np.int64)
+    if dropped > 0:
+        earlier = []  # the dropped largest indexes of the genes so far
+        for g, until in enumerate(gene_too_small_until.tolist()):
+            dropping_from[g] = earlier[0] if len(earlier) == dropped else 0
+            (heapq.heappushpop if len(earlier) == dropped else heapq.heappush)(earlier, until)
+
+    # a domain is assayed over [too_small_until, kept_until) and from after_too_small on
+    kept_until = np.minimum(dropping_from[gene], after_too_small)
+    start = np.concatenate((too_small_until, after_too_small))
+    end = np.concatenate((kept_until, np.full(len(gene), size)))
+    rejected_from = np.concatenate((rejected_from, rejected_from))
+    gene = np.concatenate((gene, gene))
+
+    assayed = gene_coverage(gene, start, end, size)
+    if wrong_if_rejected:
+        called = gene_coverage(gene, np.maximum(start, rejected_from), end, size)
+    else:
+        called = gene_coverage(gene, start, np.minimum(end, rejected_from), size)
+    return assayed, called
+
+
+def roc_sweep(names, pvalues_list, pvaluing_array, thresholds=None):
+    ''' The roc_sweep function computes the true positive rate (TPR) and the 
+    specificity of the essentiality calls of the benchmark genes at every 
+    p-value threshold. The p-values are corrected once: a domain is 
+    significant from its adjusted p-value on, and a non significant domain 
+    without insertions is too small for assaying (and dropped from the 
+    benchmark sets, while they keep at least 30 genes) while the threshold, 
+    corrected for the number of tests, does not exceed its p-value. These 
+    breaks are placed among the sorted thresholds with np.searchsorted, and 
+    the counts of the benchmark genes at every threshold are cumulated from 
+    them (benchmark_counts). Unless other thresholds are given, it returns 
+    the exact ROC curve: every threshold up to variables.pvalue at which the 
+    calls change, in decreasing order, with its [1 - specificity, TPR] point. '''
 
-    pvaluing_array_copy = pvaluing_array.copy()
     baseline_essentials = set(variables.true_positives.keys())
     baseline_non_essentials = set(variables.true_negatives.keys())
-    
-    pvaluing_array_discard, strain_existent_essentials, fdr, rejected_baseline_essentials, \
-        rejected_baseline_nonessentials, strain_existent_nonessentials = pvaluing(
-            names, pvalues_list, pvaluing_array_copy, pvalue, variables, baseline_essentials, baseline_non_essentials)
-
-    if len(pvaluing_array_discard) == 1:  # if there is only the header
-        rejected_baseline_essentials = strain_existent_essentials
-
-    TP = len(strain_existent_essentials) - len(rejected_baseline_essentials)
-    FN = len(rejected_baseline_essentials)
-
-    if (TP + FN) != 0:
-        TPR_sensitivity = TP / float(TP + FN)
-    else:
-        TPR_sensitivity = 0
-
-    TN = len(strain_existent_nonessentials) - \
-        len(rejected_baseline_nonessentials)
-    FP = len(rejected_baseline_nonessentials)
-
-    if (TN + FP) != 0:
-        specificity = 1 - (TN / float(TN + FP))
-    else:
-        specificity = 0
-
-    pvalue_listing.append(pvalue)
-    euclidean_points.append([specificity] + [TPR_sensitivity])
-
-    return pvalue_listing, euclidean_points
-
-
-def class_to_numba(basket):
-    ''' The class_to_numba function takes a dictionary basket containing gene 
-    information and extracts significant gene domains to convert them into 
-    arrays that can be used with the numba library. It first loops through the 
-    dictionary to extract gene names, p-values, and domain-related information. 
-    Then, it creates a pvaluing_array containing this information in a numerical 
-    format. Finally, it calls the reference_essentials_loader function to load 
-    essential and non-essential gene lists, which are returned along with the 
-    pvaluing_array, names, and pvalues_list.  '''
-
-    pvaluing_array, names, pvalues_list = [], [], []
-    for gene in basket:
-        for domain in basket[gene].significant:
-            part = 0
-            if basket[gene].significant[domain].domain_part == "whole gene":
-                part = 1
-            names.append(basket[gene].gene)
-            pvalues_list.append(basket[gene].significant[domain].pvalue)
-            pvaluing_array.append(np.array((basket[gene].length,
-                                           part,
-                                           basket[gene].significant[domain].dom_len,
-                                           1,  # non essential
-                                           basket[gene].significant[domain].pvalue,
-                                           basket[gene].significant[domain].dom_insert),
-                                           dtype=np.float64))
-
-    pvaluing_array = np.array(pvaluing_array)
-    return pvaluing_array, names, pvalues_list
-
-
-def multi_pvalue_iter(basket):
-    ''' This function performs multiple iterations of p-value thresholding to 
-    determine true positive and false positive rates for a set of genes, 
-    using parallel processing for efficiency. It takes a dictionary of genes 
-    and their properties, converts them to Numpy arrays, and returns the 
-    resulting lists of p-value thresholds and corresponding true/false positive rates.  '''
-
-    # change here to increase resolution of iteration
-    pvalue = [variables.pvalue * 0.5 ** i for i in range(200)]
-    result_objs, pvalue_listing, euclidean_points = [], [], []
-
-    pvaluing_array, names, pvalues_list = class_to_numba(basket)
-
-    pool = multiprocessing.Pool(processes = variables.cpus)
-    for p in pvalue:
-        result = pool.apply_async(pvalue_iteration, args=((names, pvalues_list, 
-                                                           pvaluing_array, p, pvalue_listing,
-                                                           euclidean_points, variables)))
-        result_objs.append(result)
-
-    pool.close()
-    pool.join()
-
-    result = [result.get() for result in result_objs]
-
-    result = sorted(result, key=lambda e: e[0][0], reverse=True)
-    pvalue_listing, euclidean_points = zip(*result)
-
-    return pvalue_listing, [n for n in zip(*euclidean_points)]
-
-
-def final_compiler(optimal_basket, pvalue, euclidean_points):
+    pvalues = np.asarray(pvalues_list, dtype=np.float64)
+    rejecting = bh_adjusted(pvalues)
+    untested = pvalues * len(pvalues)
+
+    rows = np.array([i for i, name in enumerate(names) 
+                     if (name in baseline_essentials) or (name in baseline_non_essentials)], dtype=np.int64)
+    benchmark_names, name_ids = np.unique(np.array([names[i] for i in rows], dtype=str), return_inverse=True)
+    essential = np.isin(benchmark_names, list(baseline_essentials))[name_ids]
+    rejecting, untested = rejecting[rows], untested[rows]
+    no_insertions = pvaluing_array[rows, 5] == 0 if len(rows) != 0 else np.zeros(0, dtype=bool)
+
+    if thresholds is None:
+        breaks = np.concatenate((rejecting, untested))
+        breaks = breaks[(breaks > 0) & (breaks <= variables.pvalue)]
+        thresholds = np.unique(np.concatenate(([variables.pvalue], breaks, np.nextafter(breaks, 0))))
+        thresholds = thresholds[thresholds > 0][::-1]
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    # indexes in the ascending thresholds: a domain is rejected from rejected_from 
+    # on, and too small below too_small_until
+    ascending = np.unique(thresholds)
+    rejected_from = np.searchsorted(ascending, rejecting, side='left')
+    too_small_until = np.where(no_insertions & ~np.isnan(untested),
+                               np.minimum(np.searchsorted(ascending, untested, side='right'), rejected_from), 0)
+
+    at = np.searchsorted(ascending, thresholds)
+    (existent_essentials, rejected_essentials), (existent_nonessentials, rejected_nonessentials) = \
+        [[count[at] for count in benchmark_counts(name_ids[members], too_small_until[members], 
+                                                  rejected_from[members], max(len(baseline) - 29, 0),
+                                                  len(ascending), wrong_if_rejected)]
+         for members, baseline, wrong_if_rejected in ((essential, baseline_essentials, False),
+                                                       (~essential, baseline_non_essentials, True))]
+    if len(pvalues) == 1:
+        rejected_essentials = existent_essentials
+
+    TP = existent_essentials - rejected_essentials
+    FN = rejected_essentials
+    TPR_sensitivity = np.where((TP + FN) != 0, TP / np.maximum(TP + FN, 1).astype(np.float64), 0)
+
+    TN = existent_nonessentials - rejected_nonessentials
+    FP = rejected_nonessentials
+    specificity = np.where((TN + FP) != 0, 1 - (TN / np.maximum(TN + FP, 1).astype(np.float64)), 0)
+
+    return thresholds, np.column_stack((specificity, TPR_sensitivity))
+
+
+def class_to_numba(basket, table):
+    ''' The class_to_numba function takes the GeneTable of the domains of a 
+    basket and converts them into arrays that can be used with the numba 
+    library: the gene name and p-value of every domain, and a pvaluing_array 
+    with the gene length, whether the domain is the whole gene, its length, 
+    its essentiality (non essential), p-value and insertions. '''
+
+    gene = table.domain_gene()
+    names = [basket[table.keys[g]].gene for g in gene]
+    pvaluing_array = np.column_stack((table.length[gene],
+                                      table.whole_gene,
+                                      table.dom_len,
+                                      np.ones(len(gene)),  # non essential
+                                      table.pvalue,
+                                      table.dom_insert)).astype(np.float64)
+
+    return pvaluing_array, names, table.pvalue
+
+
+def multi_pvalue_iter(basket, table):
+    ''' This function computes the true positive and false positive rates of 
+    the benchmark genes over the p-value thresholds, with a single sweep over 
+    the sorted p-values (see roc_sweep). It takes a dictionary of genes 
+    and the GeneTable of their domains, converts them to Numpy arrays, and returns the 
+    array of p-value thresholds and the array of their [1 - specificity, TPR] points.  '''
+
+    pvaluing_array, names, pvalues_list = class_to_numba(basket, table)
+    return roc_sweep(names, pvalues_list, pvaluing_array)
+
+
+def final_compiler(optimal_basket, table, pvalue, euclidean_points):
     ''' The final_compiler function takes a dictionary of genes and their 
     properties and performs essentiality calling and statistical analysis 
     using p-value thresholding. The function converts the gene dictionary into 
@@ -1172,7 +1253,7 @@ def final_compiler(optimal_basket, pvalue, euclidean_points):
     curve plot for the data. Finally, the function saves the table and plot 
     to files in a specified directory. '''
 
-    pvaluing_array, names, pvalues_list = class_to_numba(optimal_basket)
+    pvaluing_array, names, pvalues_list = class_to_numba(optimal_basket, table)
 
     fdr = statsmodels.stats.multitest.multipletests(
         pvalues_list, pvalue, "fdr_bh")  # multitest correction, fdr_bh
@@ -1202,22 +1283,27 @@ def final_compiler(optimal_basket, pvalue, euclidean_points):
                   ["Insertion Orientation ratio (+/total)"] + ["Insertion Orientation p-value"] +
                   ["gene region"] + ["Gene Orientation"] + ["Gene name"] + ["Essentiality"]]
 
-    i = 0
-    for gene in optimal_basket:
-        for domain in optimal_basket[gene].significant:
-            genes_list.append([optimal_basket[gene].significant[domain].dom_insert] +
-                              [str(optimal_basket[gene].significant[domain].pvalue).replace("'","")] +
-                              [optimal_basket[gene].contig] +
-                              [optimal_basket[gene].identity] +
-                              [optimal_basket[gene].product] +
-                              [int(optimal_basket[gene].significant[domain].dom_len/2)] +
-                              [optimal_basket[gene].significant[domain].ratio_orient] +
-                              [optimal_basket[gene].significant[domain].orient_pvalue] +
-                              [optimal_basket[gene].significant[domain].domain_part] +
-                              [optimal_basket[gene].orientation] +
-                              [optimal_basket[gene].gene] +
-                              [essentiality[i]])
-            i += 1
+    def not_available(value):
+        return "N/A" if np.isnan(value) else value
+
+    for i, g in enumerate(table.domain_gene()):
+        gene = optimal_basket[table.keys[g]]
+        if table.whole_gene[i]:
+            domain = "whole gene"
+        else:
+            domain = f"{table.region_start[i]} to {table.region_end[i]}"
+        genes_list.append([table.dom_insert[i]] +
+                          [str(table.pvalue[i]).replace("'","")] +
+                          [gene.contig] +
+                          [gene.identity] +
+                          [gene.product] +
+                          [int(table.dom_len[i]/2)] +
+                          [not_available(table.ratio_orient[i])] +
+                          [not_available(table.orient_pvalue[i])] +
+                          [domain] +
+                          [gene.orientation] +
+                          [gene.gene] +
+                          [essentiality[i]])
 
     # there is some issue with the couting
     significant_genes_list = list(
@@ -1277,7 +1363,7 @@ def final_compiler(optimal_basket, pvalue, euclidean_points):
         0, ["#Number of whole genes that are essential: %s" % len(significant_genes_list)])
 
     output_writer(variables.directory, variables.output_name, genes_list)
-    x, y = zip(*euclidean_points[0])
+    x, y = zip(*euclidean_points)
 
     fig, ax1 = plt.subplots()
     plt.xlim(0, 1)
@@ -1294,7 +1380,7 @@ def final_compiler(optimal_basket, pvalue, euclidean_points):
     plt.savefig(
         f"{variables.directory}/ROC_curves{variables.strain}.png", dpi=300)
     plt.close()
-    gene_essentiality_compressor(optimal_basket,genes_list)
+    gene_essentiality_compressor(optimal_basket,table,genes_list)
 
 
 def genome_loader(startup=True):
@@ -1325,6 +1411,8 @@ def genome_loader(startup=True):
                 colourful_errors("INFO",
                     f"Loaded contig {contig}")
             variables.genome_length += len(variables.genome_seq[contig])
+            if contig not in variables.motif_index:
+                variables.motif_index[contig] = motif_indexer(variables.genome_seq[contig])
 
     elif variables.annotation_type == "gb":
         for rec in SeqIO.parse(variables.annotation_file_paths[0], "gb"):
@@ -1337,6 +1425,9 @@ def genome_loader(startup=True):
                 colourful_errors("INFO",
                     f"Loaded contig {variables.annotation_contig}")
             variables.genome_seq[variables.annotation_contig] = str(rec.seq)
+            if variables.annotation_contig not in variables.motif_index:
+                variables.motif_index[variables.annotation_contig] = motif_indexer(
+                    variables.genome_seq[variables.annotation_contig])
 
 def domain_iterator(basket):
     ''' The function domain_iterator performs an iterative process to find 
@@ -1349,52 +1440,29 @@ def domain_iterator(basket):
     set of genomic regions, the optimal p-value threshold, and the ROC data used 
     to determine the optimal threshold. '''
 
-    def ROC(basket):
-        def orientation_pvaluing(basket):
-            pvalues_orient = []
-            for key in basket:
-                for domain in basket[key].significant:
-                    pvalues_orient.append(
-                        basket[key].significant[domain].orient_pvalue)
-            pvalues_orient = [
-                score for score in pvalues_orient if score != "N/A"]
-
-            if len(pvalues_orient) > 0:
+    def ROC(basket, table):
+        def orientation_pvaluing(table):
+            tested = ~np.isnan(table.orient_pvalue)
+            if np.any(tested):
                 fdr = statsmodels.stats.multitest.multipletests(
-                    pvalues_orient, 0.01, "fdr_bh")  # multitest correction, fdr_bh
-            p = 0
-            for key in basket:
-                for domain in basket[key].significant:
-                    if basket[key].significant[domain].orient_pvalue != "N/A":
-                        basket[key].significant[domain].orient_pvalue = fdr[1][p]
-                        p += 1
-            return basket
-
-        basket = orientation_pvaluing(basket)
-        pvalue_listing, euclidean_points = multi_pvalue_iter(basket)
-        # point where TPR_sensitivity = 1 and 1-specificity = 0
-        convergence = [[0] + [1]] * len(np.array(euclidean_points[0]))
-
-        #lower is better
-        distances = scipy.spatial.distance.cdist(
-            np.array(euclidean_points[0]), np.array(convergence), 'euclidean')
-
-        optimal_distance = []
-        # returns first entry of the array of ecludian
-        list(filter(lambda x: optimal_distance.append(x[0]), distances))
-        # gives the index of the inflexion point. that minimizes the eucledian distances
-        inflexion_points_index = (
-            optimal_distance.index(min(optimal_distance)))
-
-        pvalue = pvalue_listing[inflexion_points_index][0]
-        best_distance = optimal_distance[inflexion_points_index]
-
-        return pvalue, best_distance, np.array(euclidean_points)
+                    table.orient_pvalue[tested], 0.01, "fdr_bh")  # multitest correction, fdr_bh
+                table.orient_pvalue[tested] = fdr[1]
+            return table
+
+        table = orientation_pvaluing(table)
+        thresholds, euclidean_points = multi_pvalue_iter(basket, table)
+
+        # distances to the point where TPR_sensitivity = 1 and 1-specificity = 0, lower is better
+        distances = np.sqrt(np.sum((euclidean_points - [0, 1]) ** 2, axis=1))
+        # the inflexion point, the first one minimizing the euclidean distance
+        inflexion_points_index = int(np.argmin(distances))
+
+        return float(thresholds[inflexion_points_index]), float(distances[inflexion_points_index]), euclidean_points
 
     def iterating(i, iterator_store, euclidean_distances, basket, current_gap):
         basket = domain_resizer(variables.domain_iteration[i], basket)
-        basket = multi_annotater(basket)
-        best_pvalue, best_distance, euclidean_points = ROC(basket)
+        table = multi_annotater(basket)
+        best_pvalue, best_distance, euclidean_points = ROC(basket, table)
         iterator_store.append(
             [current_gap] + [best_pvalue] + [best_distance] + [i] + [euclidean_points])
         return iterator_store
@@ -1441,7 +1509,7 @@ def domain_iterator(basket):
 
     legenda = [n[0] for n in iterator_store]
     for i in iterator_store:
-        z, x = zip(*i[4][0])
+        z, x = zip(*i[4])
         ax1.plot(z, x)
 
     ax1.plot(ax1.get_xlim(), ax1.get_ylim(), ls="--", c=".3")
@@ -1455,11 +1523,11 @@ def domain_iterator(basket):
     plt.close()
     best_index = int(sorted_optimal[0][3])
     output_writer(variables.directory, "Best_ROC_points{}".format(
-        variables.output_name), iterator_store[best_index][4][0])
+        variables.output_name), iterator_store[best_index][4])
 
     return best_index, iterator_store[best_index][1], iterator_store[best_index][4]
 
-def gene_essentiality_compressor(basket,genes_list):
+def gene_essentiality_compressor(basket,table,genes_list):
     
     essentials = pd.read_csv(f"{variables.directory}/{variables.output_name}.csv",
                              skiprows=9,low_memory=False)
@@ -1518,14 +1586,14 @@ def gene_essentiality_compressor(basket,genes_list):
                   ["Contig"] + ["Gene Lenght"] + ["Gene Product"] +
                   ["Total Number of insertions"] + ["Essentiality"]]
 
-    for gene in basket:
+    for gene, insertions in zip(table.keys, table.insertions):
         final_out.append([basket[gene].identity] +
                           [basket[gene].gene] +
                           [basket[gene].orientation] +
                           [basket[gene].contig] +
                           [basket[gene].length] +
                           [basket[gene].product] +
-                          [sum(basket[gene].domain_insertions_total)] +
+                          [insertions] +
                           [essentials[essentials["Gene ID"]==gene]["Full gene essentiality"].iloc[0]])
     
     output_writer(variables.directory, f"{variables.output_name}_final", final_out)
@@ -1548,15 +1616,21 @@ def main(argv):
         evaluator_basket = gene_insertion_matrix(evaluator_basket)
         best_index, pvalue, euclidean_points = domain_iterator(evaluator_basket)
     else:
-        best_index, pvalue, euclidean_points = 0,variables.pvalue,[[[0,0],[0,0]]]
+        best_index, pvalue, euclidean_points = 0,variables.pvalue,np.array([[0,0],[0,0]])
 
     genome_loader(startup=False) # create a cleaner version where this doesnt need to repeat
     insertions_parser(startup=False)
     basket = basket_storage()
     basket = gene_insertion_matrix(basket)
     best_basket = domain_resizer(variables.domain_iteration[best_index], basket)
-    best_basket = multi_annotater(best_basket)
-    final_compiler(best_basket, pvalue, euclidean_points)
+    best_table = multi_annotater(best_basket)
+    colourful_errors("INFO",
+        f"Reused cached p-values: {variables.pvalue_cache.summary()}.")
+    final_compiler(best_basket, best_table, pvalue, euclidean_points)
+
+    if variables.pool is not None:
+        variables.pool.close()
+        variables.pool.join()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
-import os,glob
+import os,glob,sys
 import subprocess
-from tnseeker import Essential_Finder,reads_trimer,sam_to_insertions,insertions_over_genome_plotter # type: ignore
+from tnseeker import Essential_Finder,reads_trimer,sam_to_insertions,insertions_over_genome_plotter,insertions_matrix,insertions_query,insertions_tracks # type: ignore
 from tnseeker.extras.helper_functions import cpu,colourful_errors
 import argparse
 from colorama import Fore
@@ -100,7 +100,7 @@ def bowtie_index_maker(variables):
     
 def bowtie_aligner_maker_single(variables):
     
-    if not os.path.isfile(f'{variables["directory"]}/alignment.sam'):
+    if variables["append"] or not os.path.isfile(f'{variables["directory"]}/alignment.sam'):
     
         send = ["bowtie2",
                 "--end-to-end",
@@ -122,7 +122,7 @@ def bowtie_aligner_maker_single(variables):
     
 def bowtie_aligner_maker_paired(variables):
     
-    if not os.path.isfile(f'{variables["directory"]}/alignment.sam'):
+    if variables["append"] or not os.path.isfile(f'{variables["directory"]}/alignment.sam'):
     
         send = ["bowtie2",
                 "--end-to-end",
@@ -172,10 +172,23 @@ def tn_compiler(variables):
                 
     return variables
 
+def lane_cleaner(variables):
+    
+    ''' Removes the trimmed reads kept (--k) from the lane already in the 
+    insertion store, as the trimmer appends to them, so that an appended lane
+    is trimmed and aligned on its own.'''
+    
+    for file in ["processed_reads_1.fastq","processed_reads_2.fastq","barcodes_1.txt"]:
+        if os.path.isfile(f'{variables["directory"]}/{file}'):
+            os.remove(f'{variables["directory"]}/{file}')
+
 def tn_trimmer_single(variables):
     
     variables["fastq_trimed"] = f'{variables["directory"]}/processed_reads_1.fastq'
     
+    if variables["append"]:
+        lane_cleaner(variables)
+    
     if not os.path.isfile(variables["fastq_trimed"]):
     
         reads_trimer.main([f"{variables['sequencing_files']}",
@@ -212,6 +225,9 @@ def tn_trimmer_paired(variables):
     variables["fastq_trimed"] = [f'{variables["directory"]}/processed_reads_1.fastq']+\
                                 [f'{variables["directory"]}/processed_reads_2.fastq']
     
+    if variables["append"]:
+        lane_cleaner(variables)
+    
     if not (os.path.isfile(variables["fastq_trimed"][0])) & (os.path.isfile(variables["fastq_trimed"][1])):
     
         reads_trimer.main([f"{variables['sequencing_files']}",
@@ -237,7 +253,9 @@ def tn_trimmer_paired(variables):
 
 def sam_parser(variables):
     
-    if not os.path.isfile(f'{variables["directory"]}/all_insertions_{variables["strain"]}.csv'):
+    if variables["reannotate"] or variables["append"] or \
+        not (os.path.isfile(f'{variables["directory"]}/all_insertions_{variables["strain"]}.csv') or \
+             os.path.isfile(f'{variables["directory"]}/all_insertions_{variables["strain"]}.parquet')):
 
         sam_to_insertions.main([f"{variables['directory']}",
                                 f"{variables['strain']}",
@@ -248,13 +266,17 @@ def sam_parser(variables):
                                 f"{variables['MAPQ']}",
                                 f"{variables['annotation_file']}",
                                 f"{variables['intergenic_size_cutoff']}",
-                                f"{variables['cpus']}"
+                                f"{variables['cpus']}",
+                                f"{variables['output_format']}",
+                                f"{variables['barcode_tables']}",
+                                "reannotate" if variables["reannotate"] else "append" if variables["append"] else "parse",
+                                f"{variables['memory']}"
                                 ]
                             )
         
     else:
         colourful_errors("INFO",
-            f"Found all_insertions_{variables['strain']}.csv, skipping tn insertion parsing.")
+            f"Found all_insertions_{variables['strain']}, skipping tn insertion parsing.")
 
 def essentials(variables):
     Essential_Finder.main([f'{variables["directory"]}',
@@ -347,6 +369,8 @@ def input_parser(variables):
     parser.add_argument("--m",nargs='?',const=None,help="Mismatches in the transposon border sequence (default is 0)")
     parser.add_argument("--k",nargs='?',const=False,help="Remove intermediate files. Default is yes, remove.")
     parser.add_argument("--e",nargs='?',const=False,help="Run only the essential determing script. required the all_insertions_STRAIN.csv file to have been generated first.")
+    parser.add_argument("--ap",nargs='?',const=True,help="Append mode: merge the reads of new sequencing files (e.g. another lane of the same library) into the insertion counts stored by a previous run, instead of starting from scratch")
+    parser.add_argument("--ra",nargs='?',const=True,help="Re-annotate the insertion counts stored by a previous run (insertion_store_STRAIN folder) with the current annotation file and --ig, without trimming, aligning or parsing the reads again")
     parser.add_argument("--t",nargs='?',const=False,help="Trims to the indicated nucleotides length AFTER finding the transposon sequence. For example, 100 would mean to keep the 100bp after the transposon (this trimmed read will be used for alignement after)")
     parser.add_argument("--b",nargs='?',const=False,help="Run with barcode extraction")
     parser.add_argument("--b1",nargs='?',const=False,help="upstream barcode sequence (example: ATC)")
@@ -355,6 +379,7 @@ def input_parser(variables):
     parser.add_argument("--b2m",nargs='?',const=False,help="downstream barcode sequence mismatches")
     parser.add_argument("--b1p",nargs='?',const=False,help="upstream barcode sequence Phred-score filtering. Default is no filtering")
     parser.add_argument("--b2p",nargs='?',const=False,help="downstream barcode sequence Phred-score filtering. Default is no filtering")
+    parser.add_argument("--bt",nargs='?',const=True,help="Also write the barcoded_insertions and annotated_barcodes tables. Barcodes are otherwise only saved as a sparse barcode x insertion matrix")
     parser.add_argument("--rt",nargs='?',const=False,help="Read threshold number")
     parser.add_argument("--ne",nargs='?',const=False,help="Run without essential Finding")
     parser.add_argument("--ph",nargs='?',const=1,help="Phred Score (removes reads where nucleotides have lower phred scores)")
@@ -366,6 +391,8 @@ def input_parser(variables):
     parser.add_argument("--sl3",nargs='?',const=None,help="3' gene trimming percent for essentiality determination (number between 0 and 1)")
     parser.add_argument("--tst",nargs='?',const=True,help="Test the program functionalities and instalations")
     parser.add_argument("--cpu",nargs='?',const=None,help="Define the number of threads (must be and integer)")
+    parser.add_argument("--of",nargs='?',const="csv",help="Output format of the insertion tables: csv (default) or parquet (compressed and typed, requires pyarrow)")
+    parser.add_argument("--mem",nargs='?',const=None,help="Memory budget (in MB) for counting the aligned reads. When set, the parsed alignments are spilled to sorted runs on disk whenever the budget is reached, and merged afterwards. Default is to count in memory")
 
     args = parser.parse_args()
                                                              
@@ -397,6 +424,14 @@ def input_parser(variables):
     if args.e is not None:
         variables["full"] = False
 
+    variables["reannotate"]=False
+    if args.ra is not None:
+        variables["reannotate"] = True
+
+    variables["append"]=False
+    if args.ap is not None:
+        variables["append"] = True
+
     variables["trim"]=False
     variables["tn_mismatches"] = 0 
     if args.tn is not None:
@@ -417,6 +452,10 @@ def input_parser(variables):
     if args.b is not None:
         variables["barcode"] = True
 
+    variables["barcode_tables"]=False
+    if args.bt is not None:
+        variables["barcode_tables"] = True
+
     variables["intergenic_size_cutoff"]=0
     if args.ig is not None:
         variables["intergenic_size_cutoff"] = int(args.ig)
@@ -477,6 +516,14 @@ def input_parser(variables):
     if args.sl3 is not None:
         variables["subdomain_length_down"]=args.sl3
 
+    variables["output_format"]="csv"
+    if args.of is not None:
+        variables["output_format"]=args.of.lower()
+
+    variables["memory"]=None
+    if args.mem is not None:
+        variables["memory"]=int(args.mem)
+
     if args.cpu is not None:
         variables["cpus"]=int(args.cpu)
     else:
@@ -512,9 +559,25 @@ def variables_initializer():
 
 def main():
 
+    if sys.argv[1:2] == ["matrix"]:
+        insertions_matrix.command_line(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["query"]:
+        insertions_query.command_line(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["tracks"]:
+        insertions_tracks.command_line(sys.argv[2:])
+        return
+
     variables = variables_initializer()
     
-    if variables["full"]:
+    if variables["reannotate"]:
+        sam_parser(variables)
+        insertions_plotter(variables)
+
+    elif variables["full"]:
         variables = bowtie_index_maker(variables)
         
         if variables["seq_type"] == "PE":
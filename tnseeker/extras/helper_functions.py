@@ -2,6 +2,15 @@ import multiprocessing
 from datetime import datetime
 from colorama import Fore
 import csv
+import os
+import shutil
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # parquet outputs are optional
+    pa = None
 
 def cpu():
     c = multiprocessing.cpu_count()
@@ -21,4 +30,122 @@ def colourful_errors(warning_type,error):
 def csv_writer(output_file_path,output_file):
     with open(output_file_path, "w", newline='') as output:
         writer = csv.writer(output)
-        writer.writerows(output_file)
\ No newline at end of file
+        writer.writerows(output_file)
+
+def parquet_support():
+    return pa is not None
+
+def table_path(folder_path,name):
+    ''' Returns the path of an output table, preferring the parquet version 
+    over the csv one when both exist.'''
+    
+    parquet_path = os.path.join(folder_path,f"{name}.parquet")
+    if os.path.isfile(parquet_path):
+        return parquet_path
+    return os.path.join(folder_path,f"{name}.csv")
+
+def table_reader(table_file_path,columns=None):
+    ''' Loads a csv or parquet output table into a pandas DataFrame. Parquet 
+    tables are memory mapped, and only the requested columns are read.'''
+    
+    if table_file_path.endswith(".parquet"):
+        return pd.read_parquet(table_file_path,columns=columns,memory_map=True)
+    return pd.read_csv(table_file_path,usecols=columns)
+
+class ParquetStreamer():
+    ''' Streams a typed, compressed parquet table to disk, one row group per
+    written batch. The schema is a list of (column name, arrow type name) 
+    pairs, and every batch a list of columns in the schema order. Requires 
+    the optional pyarrow package.'''
+    
+    def __init__(self,output_file_path,schema,compression="zstd"):
+        self.schema = pa.schema([(name,getattr(pa,kind)()) for name,kind in schema])
+        self.writer = pq.ParquetWriter(output_file_path,self.schema,compression=compression)
+        
+    def write(self,columns):
+        self.writer.write_table(pa.Table.from_arrays([pa.array(column,type=field.type) for column,field in zip(columns,self.schema)],
+                                                     schema=self.schema))
+
+    def write_table(self,table):
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+class TableStreamer():
+    ''' Writes rows to a csv or parquet table as they come, holding at most 
+    batch_size rows in memory. The csv header is written first, unless header
+    is False, as for the part files later joined by table_concatenator.'''
+    
+    def __init__(self,output_file_path,columns,output_format="csv",header=True,batch_size=100000):
+        self.rows = []
+        self.batch_size = batch_size
+        self.output_format = output_format
+        
+        if output_format == "parquet":
+            self.writer = ParquetStreamer(output_file_path,columns)
+        else:
+            self.output = open(output_file_path,"w",newline='')
+            self.writer = csv.writer(self.output)
+            if header:
+                self.writer.writerow([name for name,kind in columns])
+
+    def write(self,row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_columns(self,columns):
+        ''' Writes a batch of rows given as a list of columns, as its own 
+        row group in parquet.'''
+        
+        self.flush()
+        if self.output_format == "parquet":
+            self.writer.write(columns)
+        else:
+            self.writer.writerows(zip(*columns))
+
+    def flush(self):
+        if len(self.rows) != 0:
+            if self.output_format == "parquet":
+                self.writer.write(list(zip(*self.rows)))
+            else:
+                self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.output_format == "parquet":
+            self.writer.close()
+        else:
+            self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def table_concatenator(output_file_path,columns,parts,output_format="csv"):
+    ''' Joins the part files written by TableStreamer into a single table, 
+    in the given order, a csv part or a parquet row group at a time.'''
+    
+    if output_format == "parquet":
+        with ParquetStreamer(output_file_path,columns) as writer:
+            for part in parts:
+                part = pq.ParquetFile(part)
+                for i in range(part.num_row_groups):
+                    writer.write_table(part.read_row_group(i))
+    else:
+        with open(output_file_path,"w",newline='') as output:
+            csv.writer(output).writerow([name for name,kind in columns])
+            for part in parts:
+                with open(part,newline='') as current:
+                    shutil.copyfileobj(current,output)
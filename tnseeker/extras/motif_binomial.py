@@ -0,0 +1,100 @@
+import numpy as np
+from scipy import fft
+from scipy.special import gammaln
+
+""" Poisson binomial distribution of the insertions of a domain, when its
+    bases only take a few distinct insertion probabilities (one per transposon
+    motif). The number of insertions is then a sum of (at most 16) binomials,
+    one per motif, and its distribution is the convolution of their pmfs, of
+    length the number of insertions instead of the number of bases. The pmfs
+    are built in log space and exponentially tilted onto the observed number
+    of insertions, so that lower tail probabilities far below the floating
+    point precision are still exact. Many domains are evaluated in one call.
+"""
+
+tilt_iterations = 30
+
+def motif_binomial_cdf(events, successes, chances):
+
+    ''' Returns Pr(X <= successes) for every domain (row of events), X being
+    the number of insertions of a domain with events[m] bases of motif m, each
+    taking an insertion with probability chances[m]. chances is a single
+    vector of motif probabilities, or one per domain. Domains with an
+    invalid probability (outside [0,1], or nan) for one of their motifs are
+    returned as nan.'''
+
+    events = np.atleast_2d(np.asarray(events, dtype=np.int64))
+    successes = np.minimum(np.asarray(successes, dtype=np.int64).reshape(-1), events.sum(axis=1))
+    chances = np.broadcast_to(np.asarray(chances, dtype=np.float64), events.shape)
+
+    with np.errstate(invalid='ignore'):
+        valid = (chances >= 0) & (chances <= 1)
+    invalid = ((events > 0) & ~valid).any(axis=1)
+    active = (events > 0) & valid & (chances > 0) # motifs with no bases, or no chance, add no insertions
+    events = np.where(active, events, 0)
+    chances = np.where(active, chances, 0.0)
+
+    theta = tilt_finder(events, chances, successes)
+    cdf = np.full(len(successes), np.nan)
+    for d in np.flatnonzero(~invalid):
+        cdf[d] = domain_cdf(events[d][active[d]], chances[d][active[d]], successes[d], theta[d])
+    return cdf
+
+def tilt_finder(events, chances, successes):
+
+    ''' Returns, for every domain, the exponential tilt under which the mean
+    number of insertions is the observed one (Newton iterations), or 0 when
+    the observed number is not below the mean. Any tilt gives the exact
+    distribution, it only decides which of its values are computed at full
+    precision.'''
+
+    theta = np.zeros(len(successes))
+    mean = (events * chances).sum(axis=1)
+    lower = np.flatnonzero((successes > 0) & (successes < mean))
+    if len(lower) == 0:
+        return theta
+
+    n, p, k = events[lower], chances[lower], successes[lower]
+    t = np.log(k / mean[lower])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(tilt_iterations):
+            q = p * np.exp(t)[:, None] / (1 - p + p * np.exp(t)[:, None])
+            slope = (n * q * (1 - q)).sum(axis=1)
+            step = np.where(slope > 0, ((n * q).sum(axis=1) - k) / slope, 0)
+            t = np.minimum(np.where(np.isfinite(step), t - step, t), 0)
+    theta[lower] = t
+    return theta
+
+def domain_cdf(n, p, k, theta):
+
+    ''' Pr(X <= k) for a single domain, X being the sum of the binomials
+    B(n[m], p[m]). The binomials are tilted by theta, truncated to k (the
+    larger values never add up to k or less) and convolved with an FFT, and
+    the tilt is then reversed on the cumulated probabilities.'''
+
+    if len(n) == 0:
+        return 1.0
+    if k == 0:
+        with np.errstate(divide='ignore'):
+            return np.exp(np.sum(n * np.log1p(-p)))
+
+    tilt = np.log1p(p * np.expm1(theta)) # log of the tilted binomial normalizer, per base
+    log_q = np.log(p) + theta - tilt
+    with np.errstate(divide='ignore'):
+        log_not_q = np.log1p(-p) - tilt
+
+    length = np.minimum(n, k) + 1
+    s = np.arange(length.max())
+    rest = n[:, None] - s
+    with np.errstate(invalid='ignore'):
+        log_pmf = gammaln(n[:, None] + 1) - gammaln(s + 1) - gammaln(np.maximum(rest, 0) + 1) + \
+                  s * log_q[:, None] + np.where(rest > 0, rest * log_not_q[:, None], 0)
+    pmf = np.where(s < length[:, None], np.exp(log_pmf), 0)
+
+    size = fft.next_fast_len(int(np.sum(length - 1)) + 1, real=True)
+    tilted = fft.irfft(np.prod(fft.rfft(pmf, size, axis=1), axis=0), size)[:k + 1]
+    tilted = np.maximum(tilted, 0)
+
+    s = np.arange(len(tilted))
+    cumulated = np.sum(tilted * np.exp(theta * (k - s)))
+    return min(np.exp(np.sum(n * tilt) - theta * k + np.log(cumulated)), 1.0)
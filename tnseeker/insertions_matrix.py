@@ -0,0 +1,216 @@
+import numpy as np
+import os, glob, shutil
+import json
+import argparse
+from scipy import sparse
+from tnseeker.sam_to_insertions import Insertions,insertion_key,contig_remapper,key_remapper,\
+                                       annotation_loader,feature_annotater
+from tnseeker.extras.helper_functions import colourful_errors,table_reader,parquet_support,TableStreamer
+
+""" Builds a single sparse sites x samples read count matrix out of many
+    tnseeker libraries mapped against the same genome (the conditions and
+    replicates of a screen). The libraries are read one at a time and spilled
+    to disk as sorted insertion keys, so that only the shared site index and
+    one library are ever held in memory. The site reads are then summed per
+    annotated gene into a genes x samples matrix.
+"""
+
+sites_columns = [("#Contig","string"),("position","int64"),("Orientation","string"),
+                 ("Gene Name","string")]
+
+def main(argv):
+    folder_path = argv[0]
+    name_folder = argv[1]
+    annotation_file = argv[2] if argv[2] != "None" else None
+    ir_size_cutoff = int(argv[3])
+    read_cut = int(argv[4])
+    output_format = argv[5]
+    libraries = argv[6:]
+
+    if (output_format == "parquet") and not parquet_support():
+        colourful_errors("WARNING",
+            "pyarrow is not installed, writing the matrix tables as .csv instead of .parquet.")
+        output_format = "csv"
+
+    if len(libraries) == 0:
+        colourful_errors("FATAL",
+            "No libraries were given to build the insertion matrix from.")
+        raise ValueError
+
+    os.makedirs(folder_path, exist_ok=True)
+    samples = sample_namer(libraries)
+
+    matrix,insertions = matrix_builder(libraries,folder_path,name_folder,read_cut)
+
+    sparse.save_npz(os.path.join(folder_path, f"insertion_matrix_{name_folder}.npz"), matrix)
+    with open(os.path.join(folder_path, f"insertion_matrix_{name_folder}_samples.txt"), "w") as current:
+        current.writelines(f"{sample}\n" for sample in samples)
+
+    if annotation_file is not None:
+        features,intergenic_features = annotation_loader(annotation_file,ir_size_cutoff)
+        insertions = feature_annotater(insertions,features)
+        insertions = feature_annotater(insertions,intergenic_features,intergenic=True)
+        gene_matrix_writer(matrix,insertions,samples,folder_path,name_folder,output_format)
+
+    sites_writer(insertions,folder_path,name_folder,output_format)
+
+    colourful_errors("INFO",
+        f"Built a {matrix.shape[0]} sites x {matrix.shape[1]} samples matrix, with {matrix.nnz} non zero counts.")
+
+def library_finder(library):
+
+    ''' Resolves a library to its insertion counts. A tnseeker output folder
+    is read from its insertion store when there is one (raw counts, no
+    parsing needed), from its all_insertions table otherwise. An
+    all_insertions table can also be given directly.'''
+
+    if os.path.isfile(library):
+        return "table",library
+
+    stores = glob.glob(os.path.join(library, "insertion_store_*", "meta.json"))
+    if len(stores) != 0:
+        return "store",os.path.dirname(stores[0])
+
+    for extension in ("parquet","csv"):
+        tables = glob.glob(os.path.join(library, f"all_insertions_*.{extension}"))
+        if len(tables) != 0:
+            return "table",tables[0]
+
+    colourful_errors("FATAL",
+        f"No insertion store or all_insertions table found for {library}.")
+    raise FileNotFoundError
+
+def library_loader(library,read_cut):
+
+    ''' Returns the contig names, the sorted packed insertion keys (see
+    insertion_key) and the read counts of a library, keeping the sites with
+    at least read_cut reads.'''
+
+    kind,path = library_finder(library)
+
+    if kind == "store":
+        with open(os.path.join(path, "meta.json")) as current:
+            contigs = json.load(current)["contigs"]
+        keys = np.load(os.path.join(path, "keys.npy"), mmap_mode='r')
+        count = np.load(os.path.join(path, "count.npy"), mmap_mode='r')
+
+    else:
+        table = table_reader(path, columns=["#Contig","position","Orientation","Read Counts"])
+        contig_id,contigs = table["#Contig"].astype(str).factorize()
+        keys = insertion_key(contig_id.astype(np.int64),
+                             table["position"].to_numpy(dtype=np.int64),
+                             (table["Orientation"] == "-").to_numpy(dtype=np.int64))
+        count = table["Read Counts"].to_numpy(dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        keys, count, contigs = keys[order], count[order], list(contigs)
+
+    kept = count >= read_cut
+    return contigs,np.asarray(keys[kept]),np.asarray(count[kept], dtype=np.int64)
+
+def sample_namer(libraries):
+
+    ''' Names every sample after its path relative to the folder shared by
+    all libraries, as the libraries of a screen usually carry the same strain
+    name.'''
+
+    paths = [os.path.abspath(library) for library in libraries]
+    if len(paths) == 1:
+        return [os.path.basename(paths[0])]
+    common = os.path.commonpath(paths)
+    return [os.path.relpath(path, common) for path in paths]
+
+def matrix_builder(libraries,folder_path,name_folder,read_cut):
+
+    ''' Out of core construction of the sites x samples matrix. In a first
+    pass every library is remapped onto the shared contig list and spilled to
+    disk, while the shared site index is grown as the union of their keys.
+    In a second pass the spilled keys are placed in the site index, one
+    library at a time, directly into the CSC arrays of the matrix (each
+    library being a column with sorted rows). Returns the matrix and the
+    sites as an Insertions table.'''
+
+    part_folder = os.path.join(folder_path, f"matrix_parts_{name_folder}")
+    os.makedirs(part_folder, exist_ok=True)
+
+    contigs,sites,sizes = [],np.zeros(0, dtype=np.int64),[]
+    for i,library in enumerate(libraries):
+        colourful_errors("INFO",
+            f"Loading {library}.")
+        library_contigs,keys,count = library_loader(library,read_cut)
+        keys = key_remapper(keys,contig_remapper(library_contigs,contigs))
+        order = np.argsort(keys, kind='stable') # contigs can come in a new order
+        np.save(os.path.join(part_folder, f"keys_{i}.npy"), keys[order])
+        np.save(os.path.join(part_folder, f"count_{i}.npy"), count[order])
+        sites = np.union1d(sites, keys)
+        sizes.append(len(keys))
+
+    indptr = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    indices = np.lib.format.open_memmap(os.path.join(part_folder, "indices.npy"), mode="w+",
+                                        dtype=np.int32, shape=(indptr[-1],))
+    data = np.lib.format.open_memmap(os.path.join(part_folder, "data.npy"), mode="w+",
+                                     dtype=np.int64, shape=(indptr[-1],))
+    for i in range(len(libraries)):
+        indices[indptr[i]:indptr[i+1]] = np.searchsorted(sites, np.load(os.path.join(part_folder, f"keys_{i}.npy"), mmap_mode='r'))
+        data[indptr[i]:indptr[i+1]] = np.load(os.path.join(part_folder, f"count_{i}.npy"), mmap_mode='r')
+
+    matrix = sparse.csc_matrix((np.array(data), np.array(indices), indptr), shape=(len(sites), len(libraries)))
+    del indices, data
+    shutil.rmtree(part_folder)
+
+    return matrix,Insertions(contigs, sites)
+
+def gene_matrix_writer(matrix,insertions,samples,folder_path,name_folder,output_format="csv"):
+
+    ''' Sums the site reads of every sample per annotated gene (or intergenic
+    region), as the product of a sparse genes x sites membership matrix with
+    the sites x samples matrix. Saves the gene_matrix_{name}.npz and a genes
+    x samples read count table.'''
+
+    annotated = np.flatnonzero(insertions.name != None)
+    genes,group = np.unique(insertions.name[annotated].astype(str), return_inverse=True)
+    membership = sparse.csr_matrix((np.ones(len(annotated), dtype=np.int64), (group, annotated)),
+                                   shape=(len(genes), len(insertions)))
+    gene_matrix = (membership @ matrix).tocsr()
+
+    sparse.save_npz(os.path.join(folder_path, f"gene_matrix_{name_folder}.npz"), gene_matrix)
+
+    columns = [("Gene Name","string")] + [(sample,"int64") for sample in samples]
+    with TableStreamer(os.path.join(folder_path, f"gene_matrix_{name_folder}.{output_format}"),
+                       columns,output_format) as writer:
+        for gene,counts in zip(genes.tolist(), gene_matrix.toarray().tolist()):
+            writer.write([gene] + counts)
+
+def sites_writer(insertions,folder_path,name_folder,output_format="csv"):
+
+    ''' Writes the site index of the matrix, the rows of insertion_matrix_{name}.npz
+    in order.'''
+
+    contig, local, orientation, border, count, mapq, name, *_ = insertions.rows()
+    with TableStreamer(os.path.join(folder_path, f"insertion_matrix_{name_folder}_sites.{output_format}"),
+                       sites_columns,output_format) as writer:
+        for row in zip(contig, local, orientation, name):
+            writer.write(row)
+
+def command_line(argv):
+    parser = argparse.ArgumentParser(prog="tnseeker matrix",
+                                     description="Build a sparse sites x samples read count matrix from many tnseeker libraries.")
+    parser.add_argument("libraries",nargs='+',help="tnseeker output folders (or all_insertions tables) of the libraries to join")
+    parser.add_argument("-o",default=os.getcwd(),help="Output folder. Default is the current folder")
+    parser.add_argument("-s",default="screen",help="Name of the matrix, used in the output file names. Default is screen")
+    parser.add_argument("--an",default=None,help="Annotation file (.gb/.gbk/.gff). When given, the reads are also summed per gene")
+    parser.add_argument("--ig",default=0,type=int,help="The number of bp up and down stream of any gene to be considered an intergenic region")
+    parser.add_argument("--rt",default=0,type=int,help="Only count the sites of a library with at least this many reads")
+    parser.add_argument("--of",default="csv",help="Output format of the sites and gene tables: csv (default) or parquet (requires pyarrow)")
+
+    args = parser.parse_args(argv)
+
+    main([args.o,
+          args.s,
+          f"{args.an}",
+          f"{args.ig}",
+          f"{args.rt}",
+          args.of.lower()] + args.libraries)
+
+if __name__ == "__main__":
+    import sys
+    command_line(sys.argv[1:])
@@ -5,7 +5,11 @@ import matplotlib
 import seaborn as sns
 from matplotlib.lines import Line2D
 import sys
+import os
 from Bio import SeqIO
+from scipy import sparse
+from tnseeker.extras.helper_functions import table_path,table_reader
+from tnseeker.sam_to_insertions import insertions_path,insertions_reader
 
 """ The script visualizes the distribution of insertions 
     in a genomic dataset. It processes the input data, processes genomic annotations, 
@@ -99,7 +103,7 @@ def reads_per_gene(directory,annotation,strain,anno_type,barcode):
 
     gene_l = get_gene_len(anno_type,annotation)
     
-    df = pd.read_csv(f"{directory}/all_insertions_{strain}.csv")
+    df = insertions_reader(insertions_path(directory,strain),columns=['Gene Name'])
     dict_df = pd.DataFrame({'Gene Name': list(gene_l.keys()), 'lenght': list(gene_l.values())})
     gene_counts = df.groupby('Gene Name').size().reset_index(name='insertions')
     merged_df = pd.merge(gene_counts, dict_df, on='Gene Name', how='left')
@@ -131,8 +135,14 @@ def reads_per_gene(directory,annotation,strain,anno_type,barcode):
     plt.show()
 
 def barcodes_per_gene(dict_df,directory,strain):
-    df = pd.read_csv(f"{directory}/annotated_barcodes_{strain}.csv")
-    gene_counts = df.groupby('Gene Name').size().reset_index(name='#Barcode')
+    matrix_path = f"{directory}/barcode_matrix_{strain}.npz"
+    if os.path.isfile(matrix_path): # barcodes per insertion, summed per gene
+        df = insertions_reader(insertions_path(directory,strain),columns=['Gene Name'])
+        df['#Barcode'] = np.diff(sparse.load_npz(matrix_path).tocsr().indptr)
+        gene_counts = df.groupby('Gene Name')['#Barcode'].sum().reset_index()
+    else:
+        df = table_reader(table_path(directory,f"annotated_barcodes_{strain}"),columns=['Gene Name'])
+        gene_counts = df.groupby('Gene Name').size().reset_index(name='#Barcode')
     
     merged_df = pd.merge(gene_counts, dict_df, on='Gene Name', how='left')
     merged_df["barcodes/gene_len"] = merged_df['#Barcode'] / merged_df['lenght']
@@ -159,22 +169,14 @@ def barcodes_per_gene(dict_df,directory,strain):
     plt.show()
     
 def plotter(directory,fasta,anno_type,strain):
-    entry=[]
-    with open(f"{directory}/all_insertions_{strain}.csv") as current:
-        for line in current:
-            line=line[:-1].split(",")
-            if '#' not in line[0]:
-                c=0.82
-                if line[2] == '+':
-                    c=0.25
-                entry.append([line[0]]+[int(line[1])]+[c]+[float(line[4])])
-    
-    entry = sorted(entry,key=lambda x: x[0])
+    insertions = insertions_reader(insertions_path(directory,strain),
+                                   columns=['#Contig','position','Orientation','Read Counts'])
     
-    df = pd.DataFrame({'contig':[n[0] for n in entry],
-                      'position':[n[1] for n in entry],
-                      'orientation':[n[2] for n in entry],
-                      'reads':[n[3] for n in entry]})
+    df = pd.DataFrame({'contig':insertions['#Contig'].astype(str).values,
+                      'position':insertions['position'].astype(int).values,
+                      'orientation':np.where(insertions['Orientation'] == '+',0.25,0.82),
+                      'reads':insertions['Read Counts'].astype(float).values})
+    df = df.sort_values('contig',kind='stable').reset_index(drop=True)
     
     contig_max = {}
     for entry in df['contig']:
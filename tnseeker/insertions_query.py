@@ -0,0 +1,82 @@
+import numpy as np
+import os, sys
+import csv
+import argparse
+from tnseeker.sam_to_insertions import InsertionStore,store_finder
+from tnseeker.extras.helper_functions import colourful_errors
+
+""" Answers region and gene queries against the insertion store of a library
+    (insertion_store_STRAIN), without reading the all_insertions table. The
+    insertions of a region are found with two binary searches in the sorted
+    store, and its reads with two lookups in the cumulative read counts.
+"""
+
+def main(argv):
+    store = argv[0]
+    list_insertions = argv[1] == "True"
+    queries = argv[2:]
+
+    if not os.path.isfile(os.path.join(store, "meta.json")):
+        colourful_errors("FATAL",
+            f"No insertion store found in {store}. Parse the alignments first.")
+        raise FileNotFoundError
+
+    insertion_store = InsertionStore(store)
+    writer = csv.writer(sys.stdout, delimiter="\t", lineterminator="\n")
+
+    if list_insertions:
+        writer.writerow(["#Query","Contig","position","Orientation","Transposon Border Sequence","Read Counts"])
+    else:
+        writer.writerow(["#Query","Insertions","Reads"])
+
+    for query in queries:
+        rows = query_rows(insertion_store,query)
+        if rows is None:
+            continue
+
+        if list_insertions:
+            contig, local, orientation, border, count, *_ = insertion_store.insertions(rows).rows()
+            for row in zip(contig, local, orientation, border, count):
+                writer.writerow([query,*row])
+        elif isinstance(rows, slice):
+            writer.writerow([query, rows.stop - rows.start, insertion_store.reads(rows.start, rows.stop)])
+        else:
+            writer.writerow([query, len(rows), int(np.asarray(insertion_store.count)[rows].sum())])
+
+def query_rows(insertion_store,query):
+
+    ''' Resolves a query to the store rows it covers: a slice for a region
+    (contig:start-end, or a whole contig), the rows of its all_insertions
+    table insertions for a gene name. Returns None for unknown queries.'''
+
+    contig, _, interval = query.rpartition(":")
+    if (contig in insertion_store.contigs) and (interval.replace("-", "", 1).isdigit()):
+        start, _, end = interval.partition("-")
+        return slice(*insertion_store.bounds(contig, int(start), int(end or start)))
+
+    if query in insertion_store.contigs:
+        return slice(*insertion_store.bounds(query))
+
+    if insertion_store.annotated:
+        rows = insertion_store.gene_rows(query)
+        if len(rows) != 0:
+            return rows
+
+    colourful_errors("WARNING",
+        f"{query} is neither a contig region nor an annotated gene of the store, skipping it.")
+    return None
+
+def command_line(argv):
+    parser = argparse.ArgumentParser(prog="tnseeker query",
+                                     description="Count, or list, the insertions of contig regions and genes from the insertion store of a library.")
+    parser.add_argument("folder",help="tnseeker output folder of the library (or its insertion_store_STRAIN folder)")
+    parser.add_argument("queries",nargs='+',help="Regions as contig:start-end (positions included) or whole contigs, counted over all the stored insertions; or gene names, counted over the insertions of the all_insertions table (after the read threshold)")
+    parser.add_argument("-s",default=None,help="Strain name, when the folder holds the stores of several strains")
+    parser.add_argument("--list",action="store_true",help="List the insertions of every query instead of counting them")
+
+    args = parser.parse_args(argv)
+
+    main([store_finder(args.folder,args.s), f"{args.list}"] + args.queries)
+
+if __name__ == "__main__":
+    command_line(sys.argv[1:])
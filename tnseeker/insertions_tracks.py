@@ -0,0 +1,148 @@
+import numpy as np
+import os, sys
+import argparse
+import pandas as pd
+from Bio import SeqIO
+from tnseeker.sam_to_insertions import InsertionStore,store_finder
+from tnseeker.extras.helper_functions import colourful_errors
+
+try:
+    import pyBigWig
+except ImportError: # bigWig tracks are optional, bedGraph tracks are written instead
+    pyBigWig = None
+
+""" Exports the insertion store of a library as genome browser tracks: the
+    read counts of every insertion site, per strand, and the density of
+    unique insertions in fixed size bins. The tracks are written as indexed
+    bigWig files, with zoom levels for browsing whole genomes, when pyBigWig
+    is installed, and as plain bedGraph files otherwise.
+"""
+
+def main(argv):
+    store = argv[0]
+    name_folder = argv[1]
+    genome_file = argv[2] if argv[2] != "None" else None
+    bin_size = int(argv[3])
+    read_cut = int(argv[4])
+    output_format = argv[5]
+    folder_path = argv[6]
+
+    if not os.path.isfile(os.path.join(store, "meta.json")):
+        colourful_errors("FATAL",
+            f"No insertion store found in {store}. Parse the alignments first.")
+        raise FileNotFoundError
+
+    if (output_format == "bigwig") and (pyBigWig is None):
+        colourful_errors("WARNING",
+            "pyBigWig is not installed, writing the tracks as .bedGraph instead of .bw.")
+        output_format = "bedgraph"
+
+    insertion_store = InsertionStore(store)
+    lengths = contig_lengths(insertion_store,genome_file)
+    tracks = track_compiler(insertion_store,lengths,bin_size,read_cut)
+
+    extension = "bw" if output_format == "bigwig" else "bedGraph"
+    for track,entries in tracks.items():
+        output_file_path = os.path.join(folder_path, f"insertion_{track}_{name_folder}.{extension}")
+        if output_format == "bigwig":
+            bigwig_writer(output_file_path,lengths,entries)
+        else:
+            bedgraph_writer(output_file_path,entries)
+
+    colourful_errors("INFO",
+        f"Insertion tracks written to {folder_path}.")
+
+def contig_lengths(insertion_store,genome_file=None):
+
+    ''' Returns the length of every contig of the store, from the genome file
+    (FASTA or genbank) when given. Contigs missing from it are given the
+    length of their last insertion.'''
+
+    lengths = {}
+    if genome_file is not None:
+        if genome_file.endswith((".gb",".gbk")):
+            for rec in SeqIO.parse(genome_file, "gb"):
+                lengths[rec.id] = len(rec.seq)
+        else:
+            for rec in SeqIO.parse(genome_file, "fasta"):
+                lengths[rec.id] = len(rec.seq)
+
+    for contig in insertion_store.contigs:
+        first, last = insertion_store.bounds(contig)
+        last_insertion = int((insertion_store.keys[last - 1] >> 1) & 0x7FFFFFFF) if last > first else 1
+        lengths[contig] = max(lengths.get(contig, 0), last_insertion)
+
+    return {contig:lengths[contig] for contig in insertion_store.contigs}
+
+def track_compiler(insertion_store,lengths,bin_size,read_cut=0):
+
+    ''' Builds the tracks in one vectorized pass over the sorted sites of each
+    contig (a slice of the store). Every track is a list of per contig
+    (contig, starts, ends, values) entries, in 0 based, half open coordinates:
+    the read counts of the + and - strand sites, and the number of unique
+    insertions (either strand) of every non empty bin.'''
+
+    tracks = {"reads_plus":[],"reads_minus":[],"density":[]}
+    for contig in insertion_store.contigs:
+        first, last = insertion_store.bounds(contig)
+        keys = np.asarray(insertion_store.keys[first:last])
+        count = np.asarray(insertion_store.count[first:last])
+        kept = count >= read_cut
+        keys, count = keys[kept], count[kept]
+
+        local = (keys >> 1) & 0x7FFFFFFF
+        minus = (keys & 1).astype(bool)
+        for track,strand in (("reads_plus",~minus),("reads_minus",minus)):
+            tracks[track].append((contig, local[strand] - 1, local[strand], count[strand].astype(np.float64)))
+
+        bins, insertions = np.unique((local - 1) // bin_size, return_counts=True)
+        tracks["density"].append((contig, bins * bin_size, np.minimum((bins + 1) * bin_size, lengths[contig]),
+                                  insertions.astype(np.float64)))
+    return tracks
+
+def bigwig_writer(output_file_path,lengths,entries):
+
+    ''' Writes a track as an indexed bigWig file, with the default zoom
+    levels. Requires the optional pyBigWig package.'''
+
+    bigwig = pyBigWig.open(output_file_path, "w")
+    bigwig.addHeader(list(lengths.items()), maxZooms=10)
+    for contig,starts,ends,values in entries:
+        if len(starts) != 0:
+            bigwig.addEntries([contig] * len(starts), starts, ends=ends, values=values)
+    bigwig.close()
+
+def bedgraph_writer(output_file_path,entries):
+    with open(output_file_path, "w", newline='') as output:
+        for contig,starts,ends,values in entries:
+            pd.DataFrame({"contig":contig,"start":starts,"end":ends,"value":values}).to_csv(
+                output, sep="\t", header=False, index=False, float_format="%g")
+
+def command_line(argv):
+    parser = argparse.ArgumentParser(prog="tnseeker tracks",
+                                     description="Export the insertion store of a library as bigWig (or bedGraph) genome browser tracks.")
+    parser.add_argument("folder",help="tnseeker output folder of the library (or its insertion_store_STRAIN folder)")
+    parser.add_argument("-s",default=None,help="Strain name, when the folder holds the stores of several strains")
+    parser.add_argument("-o",default=None,help="Output folder. Default is the library folder")
+    parser.add_argument("--genome",default=None,help="FASTA or genbank file of the genome, for the contig lengths. Default is the position of the last insertion of each contig")
+    parser.add_argument("--bin",default=100,type=int,help="Bin size (bp) of the unique insertion density track. Default is 100")
+    parser.add_argument("--rt",default=0,type=int,help="Only export the sites with at least this many reads")
+    parser.add_argument("--bedgraph",action="store_true",help="Write plain bedGraph tracks instead of bigWig")
+
+    args = parser.parse_args(argv)
+
+    store = store_finder(args.folder,args.s)
+    name_folder = os.path.basename(os.path.normpath(store))[len("insertion_store_"):]
+    folder_path = args.o or os.path.dirname(os.path.normpath(store))
+    os.makedirs(folder_path, exist_ok=True)
+
+    main([store,
+          name_folder,
+          f"{args.genome}",
+          f"{args.bin}",
+          f"{args.rt}",
+          "bedgraph" if args.bedgraph else "bigwig",
+          folder_path])
+
+if __name__ == "__main__":
+    command_line(sys.argv[1:])
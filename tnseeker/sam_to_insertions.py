@@ -1,7 +1,13 @@
 import numpy as np
-import os, glob
-from regex import findall
-from tnseeker.extras.helper_functions import colourful_errors,csv_writer
+import os, glob, shutil
+import mmap
+import json
+import hashlib
+from scipy import sparse
+from numba import njit
+from tnseeker.extras.helper_functions import colourful_errors,parquet_support,\
+                                             TableStreamer,table_concatenator,table_path,table_reader
+import pandas as pd
 from matplotlib import pyplot as plt
 import argparse
 from Bio import SeqIO
@@ -15,6 +21,26 @@ from colorama import Fore
     and generate statistics, including the read histogram, for further analysis.
 """
     
+# output table layouts, as (column name, type) pairs
+insertions_columns = [("#Contig","string"),("position","int64"),("Orientation","string"),
+                      ("Transposon Border Sequence","string"),("Read Counts","int64"),
+                      ("Average mapQ across reads","float64"),("Gene Name","string"),
+                      ("Gene Product","string"),("Gene Orientation","string"),
+                      ("Relative Position in Gene (0-1)","float64")]
+
+barcoded_insertions_columns = [("#Contig","string"),("position","int64"),("Orientation","string"),
+                               ("Total Reads","int64"),("Average MapQ","float64"),("Gene Name","string"),
+                               ("Gene Product","string"),("Gene Orientation","string"),
+                               ("Relative Position in Gene (0-1)","float64"),
+                               ("Number of different barcodes in coordinate","int64"),
+                               ("Total barcode Reads","int64"),("Barcodes (barcode:read)","string")]
+
+annotated_barcodes_columns = [("#Barcode","string"),("Barcode Reads","int64"),
+                              ("Contig","string"),("position","int64"),("Orientation","string"),
+                              ("Total Reads in position","int64"),("Average MapQ","float64"),
+                              ("Gene Name","string"),("Gene Product","string"),("Gene Orientation","string"),
+                              ("Relative Position in Gene (0-1)","float64")]
+
 def main(argv):
     folder_path = argv[0]
     name_folder = argv[1]
@@ -26,12 +52,29 @@ def main(argv):
     annotation_file = argv[7]
     ir_size_cutoff = int(argv[8])
     cpus = int(argv[9])
-    pool = multiprocessing.Pool(processes = cpus)
+    output_format = argv[10] if len(argv) > 10 else "csv"
+    barcode_tables = (len(argv) > 11) and (argv[11] == "True")
+    mode = argv[12] if len(argv) > 12 else "parse"
+    memory = int(argv[13]) if (len(argv) > 13) and (argv[13] != "None") else None
+    
+    if (output_format == "parquet") and not parquet_support():
+        colourful_errors("WARNING",
+            "pyarrow is not installed, writing the insertion tables as .csv instead of .parquet.")
+        output_format = "csv"
+    
+    # parsed once here, the workers inherit it when the pool starts
+    annotation = annotation_loader(annotation_file,ir_size_cutoff)
+    pool = multiprocessing.Pool(processes = cpus,
+                                initializer = annotation_initializer,
+                                initargs = annotation)
 
-    pathing = path_finder(folder_path)
-    extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
-              read_threshold,read_cut,annotation_file,ir_size_cutoff,\
-              cpus,pool,map_quality_threshold)
+    if mode == "reannotate":
+        reannotator(name_folder,folder_path,read_threshold,read_cut,cpus,pool,output_format,barcode_tables)
+    else:
+        pathing = path_finder(folder_path)
+        extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
+                  read_threshold,read_cut,cpus,pool,map_quality_threshold,output_format,barcode_tables,
+                  append = mode == "append", memory = memory)
 
 def path_finder(folder_path): 
     filenames = []
@@ -50,11 +93,9 @@ def adjust_spines(ax, spines,x,y): #offset spines
         else:
             spine.set_color('none')  # don't draw spine
 
-def plotter(insertion_count, naming, output_folder):
+def plotter(insertions, naming, output_folder):
     
-    reads = []
-    for key in insertion_count:
-        reads.append(insertion_count[key].count)
+    reads = insertions.count
 
     log_reads = np.log10(reads)
     
@@ -84,24 +125,198 @@ def plotter(insertion_count, naming, output_folder):
     
     return statstics
 
-class Insertion():
-    
-    def __init__(self, contig=None, local=None, border=None, orientation=None,\
-                 count=None,barcode=None,name=None,product=None,gene_orient=None,
-                 relative_gene_pos=None,mapQ=0,read_id=None):
-        
-        self.contig = contig
-        self.local = local
-        self.orientation = orientation
-        self.seq = border
-        self.count = count
-        self.mapQ = mapQ
-        self.barcode = barcode or {}
-        self.name = name
-        self.product = product
-        self.gene_orient = gene_orient
-        self.relative_gene_pos = relative_gene_pos
-        self.read_id = read_id
+def insertion_key(contig_id, local, orientation):
+    
+    ''' Packs an insertion site into a single int64 key: the contig id takes 
+    the upper 32 bits, followed by the position (31 bits) and a strand bit 
+    (0 for +, 1 for -). Sorting the keys thus sorts the insertions by contig, 
+    position and strand. Works on both ints and NumPy arrays.'''
+    
+    return (contig_id << 32) | (local << 1) | orientation
+
+class Insertions():
+    
+    ''' Column wise table of the unique transposon insertions. Every site is
+    stored as a packed int64 key (see insertion_key), kept sorted, and all
+    other attributes (read counts, MAPQ sums, border sequences and the gene 
+    annotation) are NumPy arrays running in parallel to the keys. Barcodes 
+    live in a separate sparse Barcodes matrix.'''
+    
+    def __init__(self, contigs=None, keys=None, count=None, mapq_sum=None, border=None,\
+                 name=None, product=None, gene_orient=None, relative_gene_pos=None):
+        
+        self.contigs = contigs or []
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else keys
+        size = len(self.keys)
+        self.count = np.zeros(size, dtype=np.int64) if count is None else count
+        self.mapq_sum = np.zeros(size) if mapq_sum is None else mapq_sum
+        self.border = np.zeros(size, dtype='S2') if border is None else border
+        self.name = np.full(size, None, dtype=object) if name is None else name
+        self.product = np.full(size, None, dtype=object) if product is None else product
+        self.gene_orient = np.full(size, None, dtype=object) if gene_orient is None else gene_orient
+        self.relative_gene_pos = np.full(size, np.nan) if relative_gene_pos is None else relative_gene_pos
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def contig_id(self):
+        return (self.keys >> 32).astype(np.int64)
+
+    @property
+    def local(self):
+        return (self.keys >> 1) & 0x7FFFFFFF
+
+    @property
+    def orientation(self):
+        return self.keys & 1
+
+    def contig_index(self, contig):
+        try:
+            return self.contigs.index(contig)
+        except ValueError:
+            return -1
+
+    def subset(self, index):
+        return Insertions(contigs=self.contigs,
+                          keys=self.keys[index],
+                          count=self.count[index],
+                          mapq_sum=self.mapq_sum[index],
+                          border=self.border[index],
+                          name=self.name[index],
+                          product=self.product[index],
+                          gene_orient=self.gene_orient[index],
+                          relative_gene_pos=self.relative_gene_pos[index])
+
+    @staticmethod
+    def concatenate(tables):
+        if len(tables) == 0:
+            return Insertions()
+        return Insertions(contigs=tables[0].contigs,
+                          keys=np.concatenate([n.keys for n in tables]),
+                          count=np.concatenate([n.count for n in tables]),
+                          mapq_sum=np.concatenate([n.mapq_sum for n in tables]),
+                          border=np.concatenate([n.border for n in tables]),
+                          name=np.concatenate([n.name for n in tables]),
+                          product=np.concatenate([n.product for n in tables]),
+                          gene_orient=np.concatenate([n.gene_orient for n in tables]),
+                          relative_gene_pos=np.concatenate([n.relative_gene_pos for n in tables]))
+
+    def rows(self):
+        
+        ''' Returns the per insertion columns as python lists, ready to be
+        written into the output tables.'''
+        
+        contig = np.array(self.contigs, dtype=object)[self.contig_id].tolist() if len(self) else []
+        orientation = np.where(self.orientation == 0, "+", "-").tolist()
+        relative_gene_pos = np.where(np.isnan(self.relative_gene_pos), None, 
+                                     self.relative_gene_pos.astype(object)).tolist()
+        return contig, self.local.tolist(), orientation, \
+               np.char.decode(self.border, "ascii").tolist(), self.count.tolist(), \
+               (self.mapq_sum / np.maximum(self.count, 1)).tolist(), self.name.tolist(), \
+               self.product.tolist(), self.gene_orient.tolist(), relative_gene_pos
+
+nucleotide_digits = str.maketrans("ACGT", "0123")
+digit_nucleotides = str.maketrans("0123", "ACGT")
+
+def barcode_encoder(bar):
+    
+    ''' 2-bit encodes an ACGT barcode of up to 31 nt into a positive integer,
+    behind a sentinel bit so that leading A's are kept. Returns None for
+    barcodes that can not be encoded (other characters, or too long).'''
+    
+    if len(bar) > 31:
+        return None
+    try:
+        return int("1" + bar.translate(nucleotide_digits), 4)
+    except ValueError:
+        return None
+
+def barcode_decoder(code):
+    return np.base_repr(code, 4)[1:].translate(digit_nucleotides)
+
+def coo_reducer(rows, columns, counts):
+    
+    ''' Sums the counts of repeated (row, column) entries of a sparse COO 
+    matrix by sorting, returning the entries in row major order.'''
+    
+    order = np.lexsort((columns, rows))
+    rows, columns, counts = rows[order], columns[order], counts[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+    first = np.flatnonzero(first)
+    if len(first) == 0:
+        return rows, columns, counts
+    return rows[first], columns[first], np.add.reduceat(counts, first)
+
+class Barcodes():
+    
+    ''' Sparse insertion x barcode read count matrix, in COO form sorted by
+    insertion (the rows, indexing the insertion table) and barcode (the 
+    columns). Each column holds a 2-bit encoded barcode (see barcode_encoder),
+    or, for the barcodes that can not be encoded, a negative code -(i + 1) 
+    pointing to overflow[i].'''
+    
+    def __init__(self, rows=None, columns=None, counts=None, codes=None, overflow=None):
+        self.rows = np.zeros(0, dtype=np.int64) if rows is None else rows
+        self.columns = np.zeros(0, dtype=np.int64) if columns is None else columns
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+        self.codes = np.zeros(0, dtype=np.int64) if codes is None else codes
+        self.overflow = overflow or []
+
+    def names(self, columns=None):
+        codes = self.codes if columns is None else self.codes[columns]
+        return [barcode_decoder(code) if code >= 0 else self.overflow[-code - 1] for code in codes.tolist()]
+
+    def save(self, folder_path, name_folder, size):
+        
+        ''' Saves the matrix as barcode_matrix_{name}.npz (scipy sparse, rows
+        following the all_insertions table), and the barcode of each column,
+        one per line, in barcode_matrix_{name}_barcodes.txt.'''
+        
+        sparse.save_npz(os.path.join(folder_path, f"barcode_matrix_{name_folder}.npz"),
+                        sparse.coo_matrix((self.counts, (self.rows, self.columns)), 
+                                          shape=(size, len(self.codes))).tocsr())
+        with open(os.path.join(folder_path, f"barcode_matrix_{name_folder}_barcodes.txt"), "w") as current:
+            current.writelines(f"{bar}\n" for bar in self.names())
+
+def insertion_reducer(keys, count, mapq_sum, border):
+    
+    ''' Collapses repeated insertion keys by sorting: read counts and MAPQ sums
+    are added up and the border sequence of the first occurrence is kept.'''
+    
+    keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    count = np.bincount(inverse, weights=count, minlength=len(keys)).astype(np.int64)
+    mapq_sum = np.bincount(inverse, weights=mapq_sum, minlength=len(keys))
+    return keys, count, mapq_sum, border[first]
+
+def insertion_ranges(cost, cpus):
+    
+    ''' Partitions the rows of the sorted insertion table into at most cpus 
+    contiguous (start, end) index ranges of about the same cost: each row 
+    goes to the share of the total cost holding the middle of its own cost 
+    along the cumulative cost. A range may span several contigs, 
+    feature_annotater annotates them one at a time.'''
+    
+    total = int(np.sum(cost))
+    if total == 0:
+        return []
+    middles = np.cumsum(cost) - np.asarray(cost) / 2
+    shares = total * np.arange(1, max(cpus, 1)) / max(cpus, 1)
+    borders = np.unique(np.concatenate(([0], np.searchsorted(middles, shares, side='right'), [len(middles)])))
+    return list(zip(borders[:-1].tolist(), borders[1:].tolist()))
+
+def sam_header_contigs(file):
+    contigs = []
+    with open(file) as current:
+        for line in current:
+            if line[0] != "@":
+                break
+            if line.startswith("@SQ"):
+                for field in line[:-1].split("\t"):
+                    if field.startswith("SN:"):
+                        contigs.append(field[3:])
+    return contigs
 
 def subprocess_cmd(command):
     try:
@@ -109,9 +324,274 @@ def subprocess_cmd(command):
     except subprocess.CalledProcessError as e:
         return e.output.decode()
 
+def sam_byte_ranges(file,cpus):
+
+    ''' Splits the body of a SAM file (everything after the @ header) into
+    one byte range per cpu. Every range starts at the beginning of a line
+    and ends right after a newline, so that no alignment is shared between
+    two ranges.'''
+
+    if os.path.getsize(file) == 0:
+        return []
+
+    with open(file, "rb") as current:
+        with mmap.mmap(current.fileno(), 0, access=mmap.ACCESS_READ) as sam:
+            body_start = 0
+            while (body_start < len(sam)) and (sam[body_start:body_start+1] == b"@"): #skips the header
+                body_start = sam.find(b"\n", body_start)
+                body_start = len(sam) if body_start == -1 else body_start + 1
+
+            body_size = len(sam) - body_start
+            ranges, start = [], body_start
+            for i in range(1, cpus+1):
+                if start >= len(sam):
+                    break
+                end = body_start + body_size * i // cpus
+                if end <= start:
+                    continue
+                end = sam.find(b"\n", end - 1)
+                end = len(sam) if (end == -1) or (i == cpus) else end + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+@njit
+def cigar_reference_span(cigars,cigar_ends):
+    
+    """ Decodes a chunk of concatenated CIGAR strings (as bytes, the i-th 
+    string spanning cigar_ends[i]:cigar_ends[i+1]) and returns the number of 
+    reference bases each alignment covers, i.e. the summed length of its 
+    M, D, N, = and X operations."""
+    
+    span = np.zeros(len(cigar_ends) - 1, dtype=np.int64)
+    for i in range(len(cigar_ends) - 1):
+        length = 0
+        for j in range(cigar_ends[i], cigar_ends[i+1]):
+            character = cigars[j]
+            if (character >= 48) and (character <= 57): #digit
+                length = length * 10 + character - 48
+            else:
+                if (character == 77) or (character == 68) or (character == 78) or \
+                   (character == 61) or (character == 88): #M D N = X
+                    span[i] += length
+                length = 0
+    return span
+
+def record_reducer(site_contig,site_local,minus,mapq,borders,cigars,barcoded_reads,barcoded_codes):
+    
+    ''' Turns the alignment records collected by sam_range_parser into 
+    sorted packed keys with read counts, MAPQ sums and borders, and the 
+    (key, barcode code, reads) barcode counts in COO form.'''
+    
+    site_local = np.array(site_local, dtype=np.int64)
+    minus = np.array(minus, dtype=bool)
+    cigar_ends = np.cumsum([0] + [len(cigar) for cigar in cigars], dtype=np.int64)
+    site_local[minus] += cigar_reference_span(np.frombuffer("".join(cigars).encode(), dtype=np.uint8),
+                                              cigar_ends) - 1 # -1 to offsset bowtie alignement
+    
+    keys = insertion_key(np.array(site_contig, dtype=np.int64), site_local, minus.astype(np.int64))
+    barcoded = coo_reducer(keys[np.array(barcoded_reads, dtype=np.int64)],
+                           np.array(barcoded_codes, dtype=np.int64),
+                           np.ones(len(barcoded_reads), dtype=np.int64))
+
+    keys, count, mapq_sum, border = insertion_reducer(keys,
+                                                      np.ones(len(keys)),
+                                                      np.array(mapq, dtype=np.float64),
+                                                      np.array(borders, dtype='S2'))
+    return keys, count, mapq_sum, border, barcoded
+
+def sam_range_parser(file,start,end,flag_list,map_quality_threshold,barcode,contigs,run_prefix=None,run_size=None):
+
+    ''' Scans the alignments found between the start and end bytes of
+    the memory mapped SAM file, and returns the partial insertion table of the
+    range as sorted packed keys with read counts, MAPQ sums and borders, 
+    the (key, barcode code, reads) barcode counts in COO form with the
+    barcodes that could not be encoded, the contig names (the header 
+    contigs, plus any contig missing from the header), and the number of 
+    aligned and quality passed reads in the range.
+    
+    With a run_size, the records are instead reduced and spilled to a sorted 
+    run on disk (see run_writer) every run_size alignments, and the list of
+    the run paths is returned in place of the partial insertion table.'''
+
+    aligned_reads, aligned_valid_reads = 0, 0
+    contig_ids = {contig: i for i,contig in enumerate(contigs)}
+    site_contig, site_local, minus, mapq, borders, cigars = [], [], [], [], [], []
+    barcoded_reads, barcoded_codes, barcode_codes, overflow = [], [], {}, []
+    runs = []
+
+    with open(file, "rb") as current:
+        with mmap.mmap(current.fileno(), 0, access=mmap.ACCESS_READ) as sam_file:
+            sam_file.seek(start)
+            while sam_file.tell() < end:
+                sam = sam_file.readline().decode().split('\t')
+                if (sam[0][0] != "@") and (sam[2] != '*'): #ignores headers and unaligned contigs
+                    local = sam[3]
+                    sequence = sam[9]
+                    contig = sam[2]
+                    flag = int(sam[1])
+                    cigar = sam[5]
+                    map_quality = float(sam[4])
+                    border, orientation = "",""
+                    aligned_reads += 1
+                    multi = "XS:i:" in sam #multiple alignemnts
+
+                    if (flag in flag_list) & (multi==False) & (map_quality >= map_quality_threshold): #only returns aligned reads witht he proper flag score
+
+                        aligned_valid_reads += 1
+
+                        if flag == flag_list[0]: #first read in pair oriented 5'to 3' (positive)
+                            orientation = "+"
+                            border = sequence[:2]
+
+                        elif flag == flag_list[1]: #first read in pair oriented 3'to 5' (negative)
+                            orientation = "-"
+                            border = sequence[::-1][:2] #needs to be reversed to make sure the start position is always the same
+                            cigars.append(cigar) #the insertion sits at the alignment end, decoded below
+
+                        if contig not in contig_ids:
+                            contig_ids[contig] = len(contigs)
+                            contigs.append(contig)
+
+                        site_contig.append(contig_ids[contig])
+                        site_local.append(int(local))
+                        minus.append(orientation == "-")
+                        mapq.append(map_quality)
+                        borders.append(border)
+
+                        if barcode:
+                            bar = None
+                            if "BC:Z:" in sam[-1]:
+                                bar = sam[-1][:-1].split(":")[2]
+                            if bar != None:
+                                if bar not in barcode_codes:
+                                    code = barcode_encoder(bar)
+                                    if code is None:
+                                        overflow.append(bar)
+                                        code = -len(overflow)
+                                    barcode_codes[bar] = code
+                                barcoded_reads.append(len(site_local) - 1)
+                                barcoded_codes.append(barcode_codes[bar])
+
+                        if (run_size is not None) and (len(site_local) >= run_size):
+                            runs.append(run_writer(f"{run_prefix}_{len(runs)}",
+                                                   *record_reducer(site_contig,site_local,minus,mapq,borders,
+                                                                   cigars,barcoded_reads,barcoded_codes)))
+                            site_contig, site_local, minus, mapq, borders, cigars = [], [], [], [], [], []
+                            barcoded_reads, barcoded_codes = [], []
+
+    keys, count, mapq_sum, border, barcoded = record_reducer(site_contig,site_local,minus,mapq,borders,
+                                                             cigars,barcoded_reads,barcoded_codes)
+    if run_size is not None:
+        if len(keys) != 0:
+            runs.append(run_writer(f"{run_prefix}_{len(runs)}",keys,count,mapq_sum,border,barcoded))
+        return runs, overflow, contigs, aligned_reads, aligned_valid_reads
+
+    return keys, count, mapq_sum, border, barcoded, overflow, contigs, aligned_reads, aligned_valid_reads
+
+# the columns of a sorted run (see run_writer), with their types
+run_columns = {"keys":np.int64,"count":np.int64,"mapq_sum":np.float64,"border":'S2',
+               "barcode_keys":np.int64,"barcode_codes":np.int64,"barcode_reads":np.int64}
+
+# approximate memory held by the parser per alignment record, and by the run
+# merge per record of each run; and the most runs merged at once
+record_bytes = 256
+merge_record_bytes = 64
+merge_fan_in = 64
+
+def run_writer(run_prefix,keys,count,mapq_sum,border,barcoded):
+    
+    ''' Saves a sorted run of reduced insertion counts, one raw binary file 
+    per column, and returns its path prefix.'''
+    
+    for name,array in zip(run_columns,(keys,count,mapq_sum,border) + tuple(barcoded)):
+        array.astype(run_columns[name]).tofile(f"{run_prefix}_{name}.bin")
+    return run_prefix
+
+def run_loader(run_prefix):
+    
+    ''' Memory maps the columns of a run.'''
+    
+    run = {}
+    for name,kind in run_columns.items():
+        path = f"{run_prefix}_{name}.bin"
+        run[name] = np.memmap(path, dtype=kind, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=kind)
+    return run
+
+def run_remover(run_prefix):
+    for name in run_columns:
+        os.remove(f"{run_prefix}_{name}.bin")
+
+def run_remapper(run_prefix,contig_remap):
+    
+    ''' Renumbers the contigs of a run onto the merged contig list. The keys
+    only need sorting again when the new contig ids change the contig order.'''
+    
+    run = {name:np.array(array) for name,array in run_loader(run_prefix).items()}
+    run["keys"] = key_remapper(run["keys"],contig_remap)
+    run["barcode_keys"] = key_remapper(run["barcode_keys"],contig_remap)
+    if np.any(np.diff(contig_remap) < 0):
+        order = np.argsort(run["keys"], kind='stable')
+        for name in ("keys","count","mapq_sum","border"):
+            run[name] = run[name][order]
+        order = np.lexsort((run["barcode_codes"], run["barcode_keys"]))
+        for name in ("barcode_keys","barcode_codes","barcode_reads"):
+            run[name] = run[name][order]
+    run_writer(run_prefix,run["keys"],run["count"],run["mapq_sum"],run["border"],
+               (run["barcode_keys"],run["barcode_codes"],run["barcode_reads"]))
+
+def run_merger(runs,run_overflows,overflow,merged_prefix,block_size):
+    
+    ''' k-way merge of sorted runs, given in file order, into a single run. 
+    Every step takes the next block_size keys of each run and reduces, across
+    all runs, the keys up to the smallest last key of these blocks: no later 
+    record can hold such a key, so they are final. As the runs are 
+    concatenated in file order, the border of a site is still the one of its
+    first read, and the result is identical to reducing all records at once.
+    The barcode codes of each run are renumbered against the shared overflow
+    (see overflow_merger). The merged runs are removed.'''
+    
+    prefixes, runs = runs, [run_loader(run) for run in runs]
+    outputs = {name:open(f"{merged_prefix}_{name}.bin", "wb") for name in run_columns}
+    
+    position, barcoded_position = [0] * len(runs), [0] * len(runs)
+    while any(position[i] < len(run["keys"]) for i,run in enumerate(runs)):
+        boundary = min(run["keys"][min(position[i] + block_size, len(run["keys"])) - 1] 
+                       for i,run in enumerate(runs) if position[i] < len(run["keys"]))
+        
+        keys, count, mapq_sum, border = [], [], [], []
+        barcoded_keys, barcoded_codes, barcoded_reads = [], [], []
+        for i,run in enumerate(runs):
+            end = position[i] + np.searchsorted(run["keys"][position[i]:position[i] + block_size], boundary, side='right')
+            keys.append(run["keys"][position[i]:end])
+            count.append(run["count"][position[i]:end])
+            mapq_sum.append(run["mapq_sum"][position[i]:end])
+            border.append(run["border"][position[i]:end])
+            position[i] = end
+            
+            end = barcoded_position[i] + np.searchsorted(run["barcode_keys"][barcoded_position[i]:], boundary, side='right')
+            barcoded_keys.append(run["barcode_keys"][barcoded_position[i]:end])
+            barcoded_codes.append(overflow_merger(np.array(run["barcode_codes"][barcoded_position[i]:end]),
+                                                  run_overflows[i],overflow))
+            barcoded_reads.append(run["barcode_reads"][barcoded_position[i]:end])
+            barcoded_position[i] = end
+        
+        block = insertion_reducer(np.concatenate(keys),np.concatenate(count),
+                                  np.concatenate(mapq_sum),np.concatenate(border)) + \
+                coo_reducer(np.concatenate(barcoded_keys),np.concatenate(barcoded_codes),np.concatenate(barcoded_reads))
+        for name,array in zip(run_columns,block):
+            array.astype(run_columns[name]).tofile(outputs[name])
+    
+    for output in outputs.values():
+        output.close()
+    del runs
+    for run in prefixes:
+        run_remover(run)
+    return merged_prefix
+
 def extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
-              read_threshold,read_cut,annotation_file,ir_size_cutoff,cpus,pool,\
-              map_quality_threshold = 42):
+              read_threshold,read_cut,cpus,pool,map_quality_threshold = 42,output_format = "csv",\
+              barcode_tables = False, append = False, memory = None):
     
     def barcode_finder():
         read = ""
@@ -132,13 +612,20 @@ def extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
 
         return barcode
 
-    aligned_reads, aligned_valid_reads = 0, 0
-    insertion_count = {}
-    
     flag_list = [0, 16]
     if paired_ended=="PE":
         flag_list = [83, 99] #[16] for single ended data #99 and 83 means that the read is the first in pair (only paired ended reads are considered as valid)
     
+    runs = [sam_fingerprint(f"{folder_path}/alignment.sam" if barcode else pathing[0])]
+    if append: # a lane already in the store is refused before any parsing
+        stored,stored_barcoded,meta = store_loader(folder_path,name_folder)
+        if runs[0] in meta["runs"]:
+            colourful_errors("WARNING",
+                "These alignments were already merged into the insertion store, leaving it untouched.")
+            pool.close()
+            pool.join()
+            return
+    
     file = pathing[0]
     if barcode:
 
@@ -154,99 +641,246 @@ def extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
     
     colourful_errors("INFO",
         "Parsing Bowtie alignments into an insertion matrix.")
-    
-    with open(file) as current:
-        for line in current:
-            sam = line.split('\t')
-            if (sam[0][0] != "@") and (sam[2] != '*'): #ignores headers and unaligned contigs
-                local = sam[3]
-                sequence = sam[9] 
-                contig = sam[2]
-                flag = int(sam[1])
-                cigar = sam[5]
-                map_quality = float(sam[4])
-                border, orientation = "",""
-                aligned_reads += 1
-                multi = "XS:i:" in sam #multiple alignemnts
-
-                if (flag in flag_list) & (multi==False) & (map_quality >= map_quality_threshold): #only returns aligned reads witht he proper flag score
-                    
-                    aligned_valid_reads += 1
-                    
-                    if flag == flag_list[0]: #first read in pair oriented 5'to 3' (positive)
-                        orientation = "+"
-                        border = sequence[:2] 
-
-                    elif flag == flag_list[1]: #first read in pair oriented 3'to 5' (negative)
-                        orientation = "-"
-                        border = sequence[::-1][:2] #needs to be reversed to make sure the start position is always the same
-
-                        #for CIGAR
-                        matches = findall(r'(\d+)([A-Z]{1})', cigar)
-                        clipped = 0
-                        for match in matches:
-                            if match[1] == "S":
-                                clipped=int(match[0])
-                                break #only consideres the first one at the start
-
-                        local=str(int(local)+len(sequence)-clipped-1) # -1 to offsset bowtie alignement
-
-                    key = (contig, local, orientation)
-                    if key not in insertion_count: 
-                        insertion_count[key] = Insertion(contig=key[0], 
-                                                         local=key[1], 
-                                                         orientation=key[2], 
-                                                         count=1, 
-                                                         border=border,
-                                                         mapQ=map_quality)
-                    else: 
-                        insertion_count[key].count += 1
-                        insertion_count[key].mapQ += map_quality
-                    
-                    if barcode:
-                        bar = None
-                        if "BC:Z:" in sam[-1]:
-                            bar = sam[-1][:-1].split(":")[2]
-                        if bar != None:
-                            if bar in insertion_count[key].barcode:
-                                insertion_count[key].barcode[bar] += 1
-                            else:
-                                insertion_count[key].barcode[bar] = 1
-
-    for key in insertion_count:
-        insertion_count[key].mapQ = insertion_count[key].mapQ / insertion_count[key].count    
-
-    len_insertion_count_divider = int(len(insertion_count) / cpus)
-    batch_goals = {}
-    for i in range(cpus):
-        batch_goals[i] = set()
-        for j,key in enumerate(insertion_count):
-            if j >= len_insertion_count_divider * i:
-                if i != cpus-1:
-                    if len(batch_goals[i]) <= len_insertion_count_divider:
-                        batch_goals[i].add(key)
-                    else:
-                        break
-                else:
-                    batch_goals[i].add(key)
 
+    contigs = sam_header_contigs(file)
+    header_contigs = len(contigs)
+    
+    run_folder, run_size = os.path.join(folder_path, f"insertion_runs_{name_folder}"), None
+    if memory is not None: # spills the parsed alignments to sorted runs on disk
+        run_size = max(memory * (1 << 20) // (cpus * record_bytes), 1)
+        os.makedirs(run_folder, exist_ok=True)
+    
     result_objs = []
-    for batch in batch_goals:
+    for i,(start,end) in enumerate(sam_byte_ranges(file,cpus)):
+        result=pool.apply_async(sam_range_parser,
+                                args=((file,
+                                       start,
+                                       end,
+                                       flag_list,
+                                       map_quality_threshold,
+                                       barcode,
+                                       contigs[:header_contigs],
+                                       os.path.join(run_folder, f"run_{i}"),
+                                       run_size)))
+        result_objs.append(result)
+
+    if memory is not None:
+        insertions,barcoded,overflow,aligned_reads,aligned_valid_reads = \
+            spilled_run_compiler(result_objs,contigs,header_contigs,run_folder,memory)
+    else:
+        insertions,barcoded,overflow,aligned_reads,aligned_valid_reads = \
+            range_compiler(result_objs,contigs,header_contigs)
+
+    if append:
+        colourful_errors("INFO",
+            "Merging the new alignments into the insertion store.")
+        insertions,barcoded,overflow = store_merger(stored,stored_barcoded,meta["overflow"],
+                                                    insertions,barcoded,list(overflow))
+        barcode = barcode or meta["barcode"]
+        aligned_reads += meta["aligned_reads"]
+        aligned_valid_reads += meta["aligned_valid_reads"]
+        runs = meta["runs"] + runs
+        
+    store_writer(folder_path,name_folder,insertions,barcoded,list(overflow),barcode,
+                 aligned_reads,aligned_valid_reads,runs)
+
+    annotation_compiler(insertions,barcoded,list(overflow),barcode,read_threshold,read_cut,
+                        cpus,pool,name_folder,folder_path,output_format,barcode_tables)
+        
+    q = plotter(insertions, f"Unique insertions_{name_folder}", folder_path)
+    shutil.rmtree(run_folder, ignore_errors=True)
+
+    reads = f" Total Aligned Reads: {aligned_reads}\nTotal Quality Passed Reads: {aligned_valid_reads}\nFiltered Vs. Raw Read % ratio: {round(aligned_valid_reads/aligned_reads*100,2)}%\n"
+    e = " Number of total unique insertions: {}\n".format(len(insertions))
+    
+    print(f"\n{Fore.YELLOW} -- Library statistics -- {Fore.RESET}\n")
+    print(f"{Fore.GREEN} Total aligned reads: {Fore.RESET}{aligned_reads}")
+    print(f"{Fore.GREEN} Total quality passed reads: {Fore.RESET}{aligned_valid_reads}")
+    print(f"{Fore.GREEN} Filtered Vs. Raw Read % ratio: {Fore.RESET}{round(aligned_valid_reads/aligned_reads*100,2)}%")
+    print(f"{Fore.GREEN} Number of total unique insertions: {Fore.RESET}{len(insertions)}")
+    print(f"\n{Fore.YELLOW} ---- {Fore.RESET}\n")
+    
+    with open("{}/library_stats_{}.txt".format(folder_path,name_folder), "w+") as current:
+        current.write(reads+q+e)
+
+def range_compiler(result_objs,contigs,header_contigs):
+    
+    ''' Merges the partial insertion tables of the sam_range_parser workers
+    into the library insertion table, all in memory.'''
+    
+    aligned_reads, aligned_valid_reads = 0, 0
+    keys, count, mapq_sum, border = [], [], [], []
+    barcoded_keys, barcoded_codes, barcoded_reads, overflow = [], [], [], {}
+
+    # merged in file order, so the border of a site is the one of its first read
+    for result in result_objs:
+        partial_keys,partial_count,partial_mapq,partial_border,(partial_barcoded_keys,partial_codes,partial_reads),\
+            partial_overflow,partial_contigs,partial_aligned,partial_valid = result.get()
+        aligned_reads += partial_aligned
+        aligned_valid_reads += partial_valid
+
+        if len(partial_contigs) > header_contigs: # contigs absent from the SAM header get their global id here
+            contig_remap = contig_remapper(partial_contigs,contigs)
+            partial_keys = key_remapper(partial_keys,contig_remap)
+            partial_barcoded_keys = key_remapper(partial_barcoded_keys,contig_remap)
+
+        partial_codes = overflow_merger(partial_codes,partial_overflow,overflow)
+
+        keys.append(partial_keys)
+        count.append(partial_count)
+        mapq_sum.append(partial_mapq)
+        border.append(partial_border)
+        barcoded_keys.append(partial_barcoded_keys)
+        barcoded_codes.append(partial_codes)
+        barcoded_reads.append(partial_reads)
+
+    insertions = Insertions(contigs, *insertion_reducer(np.concatenate(keys or [np.zeros(0, dtype=np.int64)]),
+                                                        np.concatenate(count or [np.zeros(0)]),
+                                                        np.concatenate(mapq_sum or [np.zeros(0)]),
+                                                        np.concatenate(border or [np.zeros(0, dtype='S2')])))
+    barcoded = coo_reducer(np.concatenate(barcoded_keys or [np.zeros(0, dtype=np.int64)]),
+                           np.concatenate(barcoded_codes or [np.zeros(0, dtype=np.int64)]),
+                           np.concatenate(barcoded_reads or [np.zeros(0, dtype=np.int64)]))
+    return insertions,barcoded,overflow,aligned_reads,aligned_valid_reads
+
+def spilled_run_compiler(result_objs,contigs,header_contigs,run_folder,memory):
+    
+    ''' Merges the sorted runs spilled to disk by the sam_range_parser 
+    workers into the library insertion table, a block of each run at a time, 
+    so that memory stays within the budget (in MB) however deep the library.'''
+    
+    aligned_reads, aligned_valid_reads = 0, 0
+    runs, run_overflows, overflow = [], [], {}
+    
+    for result in result_objs:
+        partial_runs,partial_overflow,partial_contigs,partial_aligned,partial_valid = result.get()
+        aligned_reads += partial_aligned
+        aligned_valid_reads += partial_valid
+        
+        if len(partial_contigs) > header_contigs:
+            contig_remap = contig_remapper(partial_contigs,contigs)
+            for run in partial_runs:
+                run_remapper(run,contig_remap)
+        
+        overflow_merger(np.zeros(0, dtype=np.int64),partial_overflow,overflow) # numbered in file order
+        runs += partial_runs
+        run_overflows += [partial_overflow] * len(partial_runs)
+    
+    colourful_errors("INFO",
+        f"Merging {len(runs)} sorted runs of alignments.")
+    
+    # runs are merged merge_fan_in at a time, in file order, until one is left
+    block_size = max(memory * (1 << 20) // (merge_fan_in * merge_record_bytes), 1)
+    level = 0
+    while (len(runs) > 1) or (level == 0):
+        runs = [run_merger(runs[i:i + merge_fan_in],run_overflows[i:i + merge_fan_in],overflow,
+                           os.path.join(run_folder, f"merged_{level}_{i // merge_fan_in}"),block_size) 
+                for i in range(0, max(len(runs), 1), merge_fan_in)]
+        run_overflows = [[]] * len(runs) # the codes are now numbered against the shared overflow
+        level += 1
+    
+    run = run_loader(runs[0])
+    return Insertions(contigs, run["keys"], run["count"], run["mapq_sum"], run["border"]),\
+           (run["barcode_keys"], run["barcode_codes"], run["barcode_reads"]),overflow,aligned_reads,aligned_valid_reads
+
+def contig_remapper(contigs,merged_contigs):
+    
+    ''' Maps the contig ids of a list of contigs onto merged_contigs, adding
+    to it the contigs it is missing.'''
+    
+    contig_remap = np.zeros(len(contigs), dtype=np.int64)
+    for i,contig in enumerate(contigs):
+        if contig not in merged_contigs:
+            merged_contigs.append(contig)
+        contig_remap[i] = merged_contigs.index(contig)
+    return contig_remap
+
+def key_remapper(keys,contig_remap):
+    return (contig_remap[keys >> 32] << 32) | (keys & 0xFFFFFFFF)
 
-        insertion_count_filtered = {}
-        for key in insertion_count:
-            if key in batch_goals[batch]:
-                insertion_count_filtered[key] = insertion_count[key]
+def overflow_merger(codes,partial_overflow,overflow):
+    
+    ''' Renumbers the negative codes of the barcodes that could not be encoded
+    against the shared overflow dict (barcode: i + 1), adding the new ones.'''
+    
+    if len(partial_overflow) != 0:
+        overflow_remap = np.array([-overflow.setdefault(bar, len(overflow) + 1) for bar in partial_overflow], dtype=np.int64)
+        codes = codes.copy()
+        codes[codes < 0] = overflow_remap[-codes[codes < 0] - 1]
+    return codes
+
+def store_merger(stored,stored_barcoded,stored_overflow,insertions,barcoded,overflow):
+    
+    ''' Adds the counts of a new alignment to the ones of the insertion store:
+    read counts, MAPQ sums and barcode reads are summed per site, and the 
+    stored border sequence of a site is kept.'''
+    
+    contigs = list(stored.contigs)
+    contig_remap = contig_remapper(insertions.contigs,contigs)
+    merged_overflow = {bar:i + 1 for i,bar in enumerate(stored_overflow)}
+    
+    merged = Insertions(contigs, *insertion_reducer(np.concatenate((stored.keys, key_remapper(insertions.keys,contig_remap))),
+                                                    np.concatenate((stored.count, insertions.count)),
+                                                    np.concatenate((stored.mapq_sum, insertions.mapq_sum)),
+                                                    np.concatenate((stored.border, insertions.border))))
+    merged_barcoded = coo_reducer(np.concatenate((stored_barcoded[0], key_remapper(barcoded[0],contig_remap))),
+                                  np.concatenate((stored_barcoded[1], overflow_merger(barcoded[1],overflow,merged_overflow))),
+                                  np.concatenate((stored_barcoded[2], barcoded[2])))
+    return merged,merged_barcoded,list(merged_overflow)
+
+def reannotator(name_folder,folder_path,read_threshold,read_cut,cpus,pool,output_format="csv",barcode_tables=False):
+    
+    ''' Annotates the insertion counts kept in the store of a previous run 
+    with the current annotation (as loaded in the pool), without parsing the
+    SAM file again. The output tables are rewritten, the library statistics
+    are left as they were.'''
+    
+    colourful_errors("INFO",
+        "Re-annotating the stored insertion counts.")
+    
+    insertions,barcoded,meta = store_loader(folder_path,name_folder)
+    annotation_compiler(insertions,barcoded,meta["overflow"],meta["barcode"],read_threshold,read_cut,
+                        cpus,pool,name_folder,folder_path,output_format,barcode_tables)
+
+def annotation_compiler(insertions,barcoded,overflow,barcode,read_threshold,read_cut,
+                        cpus,pool,name_folder,folder_path,output_format="csv",barcode_tables=False):
+    
+    ''' Filters the raw insertion counts by the read threshold, builds the 
+    barcode matrix, annotates the insertions in the worker pool, and writes 
+    the output tables.'''
+
+    annotated = insertions
+    if read_threshold:
+        annotated = dict_filter(insertions,read_cut)
+
+    if barcode:
+        barcodes = barcode_matrix(annotated,*barcoded,overflow)
+        barcodes.save(folder_path,name_folder,len(annotated))
+
+    # the barcoded tables are streamed by each worker into its own part file
+    barcode_tables = barcode and barcode_tables
+    part_folder = os.path.join(folder_path, f"barcode_parts_{name_folder}")
+    if barcode_tables:
+        os.makedirs(part_folder, exist_ok=True)
+
+    # each kept insertion costs a row, plus a row per barcode when the barcoded tables are streamed
+    read_cut = read_cut if read_threshold else 0
+    cost = (insertions.count >= read_cut).astype(np.int64)
+    if barcode_tables:
+        cost += cost * np.bincount(np.searchsorted(insertions.keys, barcoded[0]), minlength=len(insertions))
+
+    # the workers read their rows from the memory mapped store, a task is only its bounds
+    result_objs = []
+    for part,(start,end) in enumerate(insertion_ranges(cost,cpus)):
 
         result=pool.apply_async(annotation_processer, 
-                            args=((insertion_count_filtered, 
-                                   read_threshold,
+                            args=((store_path(folder_path,name_folder),
+                                   start,
+                                   end,
                                    read_cut,
-                                   barcode,
-                                   annotation_file,
-                                   ir_size_cutoff,
-                                   name_folder,
-                                   folder_path)))
+                                   barcode_tables,
+                                   os.path.join(part_folder, f"part_{part}"),
+                                   output_format)))
     
         result_objs.append(result)
     pool.close()
@@ -254,122 +888,424 @@ def extractor(name_folder, folder_path, pathing, paired_ended,barcode,\
         
     result = [result.get() for result in result_objs]
     
-    final_compiler = {}
-    barcoded_insertions_final = []
-    insertions_final = []
+    if barcode_tables:
+        annotate_barcodes_writer(len(result),part_folder,name_folder,folder_path,output_format)
+        
+    annotated = Insertions.concatenate(result)
+    dictionary_parser(annotated,folder_path,name_folder,output_format)
+    store_annotation_writer(folder_path,name_folder,insertions,annotated)
 
-    for entry in result:
-        insertion,barcoded,insert = entry
-        final_compiler = {**final_compiler, **insertion}
+def store_path(folder_path,name_folder):
+    return os.path.join(folder_path, f"insertion_store_{name_folder}")
 
-        if barcode:
-            for barcode in barcoded:
-                barcoded_insertions_final.append(barcode)
-        
-        for insertion in insert:
-            insertions_final.append(insertion)
+def sam_fingerprint(file):
     
-    if barcode:
-        annotate_barcodes_writer(barcoded_insertions_final,insertions_final,name_folder,folder_path)
+    ''' Content fingerprint of an alignment file (its size, first and last
+    MB), used to refuse merging the same alignment twice into the store.'''
+    
+    digest = hashlib.sha1(str(os.path.getsize(file)).encode())
+    with open(file, "rb") as current:
+        digest.update(current.read(1 << 20))
+        current.seek(max(os.path.getsize(file) - (1 << 20), 0))
+        digest.update(current.read())
+    return digest.hexdigest()
+
+def store_writer(folder_path,name_folder,insertions,barcoded,overflow,barcode,aligned_reads,aligned_valid_reads,runs=None):
+    
+    ''' Persists the raw, unannotated insertion counts of the library (packed
+    keys, read counts, MAPQ sums and borders, and the reduced barcode counts)
+    as .npy arrays, with a meta.json holding the contig names, the barcodes 
+    that could not be encoded, the read statistics and the fingerprints of 
+    the alignments counted so far. Insertions can then 
+    be re-annotated without parsing the SAM file again. The index of the 
+    store, the first row of every contig (offsets) and the running read count
+    (cumulative_count, with a leading 0), is saved alongside for the range
+    queries of InsertionStore.'''
+    
+    store = store_path(folder_path,name_folder)
+    os.makedirs(store, exist_ok=True)
+    
+    for name,array in (("keys",insertions.keys),("count",insertions.count),
+                       ("mapq_sum",insertions.mapq_sum),("border",insertions.border),
+                       ("barcode_keys",barcoded[0]),("barcode_codes",barcoded[1]),
+                       ("barcode_reads",barcoded[2]),
+                       ("offsets",store_offsets(insertions.keys,len(insertions.contigs))),
+                       ("cumulative_count",np.concatenate(([0], np.cumsum(insertions.count))))):
+        np.save(os.path.join(store, f"{name}.npy"), array)
+    
+    with open(os.path.join(store, "meta.json"), "w") as current:
+        json.dump({"contigs":insertions.contigs,
+                   "overflow":overflow,
+                   "barcode":barcode,
+                   "aligned_reads":aligned_reads,
+                   "aligned_valid_reads":aligned_valid_reads,
+                   "runs":runs or []}, current, indent=1)
+
+def store_loader(folder_path,name_folder):
+    
+    ''' Loads the raw insertion counts written by store_writer. Returns the
+    unannotated Insertions, the (keys, codes, reads) barcode counts and the 
+    meta data.'''
+    
+    store = store_path(folder_path,name_folder)
+    if not os.path.isfile(os.path.join(store, "meta.json")):
+        colourful_errors("FATAL",
+            f"No insertion store found in {store}. Parse the alignments first.")
+        raise FileNotFoundError
+    
+    with open(os.path.join(store, "meta.json")) as current:
+        meta = json.load(current)
+    meta.setdefault("runs", [])
+    
+    arrays = {name:np.load(os.path.join(store, f"{name}.npy")) for name in 
+              ("keys","count","mapq_sum","border","barcode_keys","barcode_codes","barcode_reads")}
+    
+    insertions = Insertions(meta["contigs"],arrays["keys"],arrays["count"],arrays["mapq_sum"],arrays["border"])
+    return insertions,(arrays["barcode_keys"],arrays["barcode_codes"],arrays["barcode_reads"]),meta
+
+def store_offsets(keys,contigs):
+    return np.searchsorted(keys, np.arange(contigs + 1, dtype=np.int64) << 32).astype(np.int64)
+
+def store_annotation_writer(folder_path,name_folder,insertions,annotated):
+    
+    ''' Saves the annotation of the all_insertions table into the store: the
+    store row of every table row (rows), its gene name as an index into the
+    gene list of annotation.json (-1 outside of any feature), and its relative
+    position in the gene.'''
+    
+    store = store_path(folder_path,name_folder)
+    named = annotated.name != None
+    genes, gene = np.unique(annotated.name[named].astype(str), return_inverse=True)
+    codes = np.full(len(annotated), -1, dtype=np.int64)
+    codes[named] = gene
+    
+    for name,array in (("rows",np.searchsorted(insertions.keys, annotated.keys)),
+                       ("gene",codes),
+                       ("relative_gene_pos",annotated.relative_gene_pos.astype(np.float64))):
+        np.save(os.path.join(store, f"{name}.npy"), array)
+    
+    with open(os.path.join(store, "annotation.json"), "w") as current:
+        json.dump({"genes":genes.tolist()}, current, indent=1)
+
+class InsertionStore():
+    
+    ''' Read only, memory mapped view of an insertion store. As the packed
+    keys are sorted, the insertions of a contig region are a contiguous slice
+    of the store, found with two binary searches within the contig offsets, 
+    and its read count is the difference of two cumulative counts. When the 
+    store holds the annotation of the last run, table() returns the 
+    all_insertions table without reading it from disk.'''
+    
+    table_columns = ["#Contig","position","Orientation","Transposon Border Sequence","Read Counts",
+                     "Average mapQ across reads","Gene Name","Relative Position in Gene (0-1)"]
+    
+    def __init__(self, store):
+        with open(os.path.join(store, "meta.json")) as current:
+            meta = json.load(current)
+        self.contigs, self.overflow = meta["contigs"], meta["overflow"]
         
-    dictionary_parser(final_compiler,folder_path,name_folder)
+        for name in ("keys","count","mapq_sum","border","barcode_keys","barcode_codes","barcode_reads"):
+            setattr(self, name, np.load(os.path.join(store, f"{name}.npy"), mmap_mode='r'))
         
-    q = plotter(insertion_count, f"Unique insertions_{name_folder}", folder_path)
+        if os.path.isfile(os.path.join(store, "offsets.npy")):
+            self.offsets = np.load(os.path.join(store, "offsets.npy"))
+            self.cumulative_count = np.load(os.path.join(store, "cumulative_count.npy"), mmap_mode='r')
+        else: # stores written before the index
+            self.offsets = store_offsets(self.keys,len(self.contigs))
+            self.cumulative_count = np.concatenate(([0], np.cumsum(self.count)))
+        
+        self.annotated = InsertionStore.readable(store)
+        if self.annotated:
+            with open(os.path.join(store, "annotation.json")) as current:
+                self.genes = np.array(json.load(current)["genes"] + [None], dtype=object) # code -1 is None
+            for name in ("rows","gene","relative_gene_pos"):
+                setattr(self, name, np.load(os.path.join(store, f"{name}.npy"), mmap_mode='r'))
 
-    reads = f" Total Aligned Reads: {aligned_reads}\nTotal Quality Passed Reads: {aligned_valid_reads}\nFiltered Vs. Raw Read % ratio: {round(aligned_valid_reads/aligned_reads*100,2)}%\n"
-    e = " Number of total unique insertions: {}\n".format(len(insertion_count))
+    @staticmethod
+    def readable(store):
+        return os.path.isfile(os.path.join(store, "meta.json")) and \
+               os.path.isfile(os.path.join(store, "annotation.json"))
+
+    def bounds(self, contig, start=None, end=None):
+        
+        ''' Returns the (first, last) store rows of the insertions of contig
+        between the start and end positions (both included), of the whole 
+        contig when no positions are given.'''
+        
+        if contig not in self.contigs:
+            return 0, 0
+        contig_id = self.contigs.index(contig)
+        first, last = self.offsets[contig_id], self.offsets[contig_id + 1]
+        if start is not None:
+            first, last = first + np.searchsorted(self.keys[first:last], 
+                                                  [insertion_key(contig_id, min(max(start, 0), 0x7FFFFFFF), 0), 
+                                                   insertion_key(contig_id, min(max(end + 1, 0), 0x7FFFFFFF), 0)])
+        return int(first), int(last)
+
+    def reads(self, first, last):
+        return int(self.cumulative_count[last] - self.cumulative_count[first])
+
+    def insertions(self, rows):
+        return Insertions(self.contigs, np.array(self.keys[rows]), np.array(self.count[rows]),
+                          np.array(self.mapq_sum[rows]), np.array(self.border[rows]))
+
+    def barcodes(self, first, last):
+        
+        ''' Returns the (keys, codes, reads) barcode counts of the store rows
+        first to last. They are sorted by key, so they are a slice as well.'''
+        
+        if last <= first:
+            return tuple(np.array(array[:0]) for array in (self.barcode_keys, self.barcode_codes, self.barcode_reads))
+        entries = slice(np.searchsorted(self.barcode_keys, self.keys[first]),
+                        np.searchsorted(self.barcode_keys, self.keys[last - 1], side='right'))
+        return tuple(np.array(array[entries]) for array in 
+                     (self.barcode_keys, self.barcode_codes, self.barcode_reads))
+
+    def gene_rows(self, gene):
+        
+        ''' Returns the store rows of the all_insertions table insertions 
+        annotated with a gene (or intergenic region) name.'''
+        
+        code = np.flatnonzero(self.genes[:-1] == gene)
+        if len(code) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.asarray(self.rows[np.asarray(self.gene) == code[0]])
+
+    def table(self, columns=None):
+        
+        ''' Returns the all_insertions table, or the requested columns of it,
+        as a pandas DataFrame.'''
+        
+        columns = columns or self.table_columns
+        table = self.insertions(np.asarray(self.rows))
+        values = {}
+        for column in columns:
+            if column == "#Contig":
+                values[column] = np.array(self.contigs, dtype=object)[table.contig_id] if len(table) else []
+            elif column == "position":
+                values[column] = table.local
+            elif column == "Orientation":
+                values[column] = np.where(table.orientation == 0, "+", "-")
+            elif column == "Transposon Border Sequence":
+                values[column] = np.char.decode(table.border, "ascii")
+            elif column == "Read Counts":
+                values[column] = table.count
+            elif column == "Average mapQ across reads":
+                values[column] = table.mapq_sum / np.maximum(table.count, 1)
+            elif column == "Gene Name":
+                values[column] = self.genes[np.asarray(self.gene)]
+            elif column == "Relative Position in Gene (0-1)":
+                values[column] = np.asarray(self.relative_gene_pos)
+            else:
+                raise KeyError(column)
+        return pd.DataFrame(values, columns=columns)
+
+def store_finder(folder_path,name_folder=None):
     
-    print(f"\n{Fore.YELLOW} -- Library statistics -- {Fore.RESET}\n")
-    print(f"{Fore.GREEN} Total aligned reads: {Fore.RESET}{aligned_reads}")
-    print(f"{Fore.GREEN} Total quality passed reads: {Fore.RESET}{aligned_valid_reads}")
-    print(f"{Fore.GREEN} Filtered Vs. Raw Read % ratio: {Fore.RESET}{round(aligned_valid_reads/aligned_reads*100,2)}%")
-    print(f"{Fore.GREEN} Number of total unique insertions: {Fore.RESET}{len(insertion_count)}")
-    print(f"\n{Fore.YELLOW} ---- {Fore.RESET}\n")
+    ''' Resolves the insertion store of a tnseeker output folder: the store of
+    name_folder when given, the folder itself when it is a store, or else the
+    first store found in it.'''
     
-    with open("{}/library_stats_{}.txt".format(folder_path,name_folder), "w+") as current:
-        current.write(reads+q+e)
+    if name_folder is not None:
+        return store_path(folder_path,name_folder)
+    if os.path.isfile(os.path.join(folder_path, "meta.json")):
+        return folder_path
+    stores = glob.glob(os.path.join(folder_path, "insertion_store_*"))
+    return stores[0] if len(stores) != 0 else folder_path
 
-def annotation_processer(insertion_count_filtered,read_threshold,read_cut,
-                         barcode,annotation_file,ir_size_cutoff,name_folder,folder_path):
+def insertions_path(folder_path,name_folder):
+    
+    ''' Path of the insertions of a library: its annotated insertion store 
+    when there is one, its all_insertions table otherwise.'''
+    
+    store = store_path(folder_path,name_folder)
+    if InsertionStore.readable(store):
+        return store
+    return table_path(folder_path,f"all_insertions_{name_folder}")
 
-    if read_threshold:
-        insertion_count_filtered=dict_filter(insertion_count_filtered,read_cut,barcode)
+def insertions_reader(insertions_file_path,columns=None):
+    
+    ''' Loads the all_insertions table of a library from its insertion store
+    (see insertions_path), or from the csv or parquet table.'''
+    
+    if os.path.isdir(insertions_file_path):
+        return InsertionStore(insertions_file_path).table(columns)
+    return table_reader(insertions_file_path,columns)
+
+def annotation_loader(annotation_file,ir_size_cutoff):
+    
+    ''' Parses the annotation file into the gene and the intergenic region 
+    FeatureIndex.'''
+    
+    colourful_errors("INFO",
+        "Loading the genome annotation.")
     
     if (annotation_file.endswith(".gb")) or (annotation_file.endswith(".gbk")):
-        insertion_count_filtered,genes,contigs = gene_parser_genbank(annotation_file,insertion_count_filtered)
+        features,genes,contigs = gene_parser_genbank(annotation_file)
         
     elif annotation_file.endswith(".gff"):
-        insertion_count_filtered,genes,contigs = gene_parser_gff(annotation_file,insertion_count_filtered)
-        
-    insertion_count_filtered = inter_gene_annotater(annotation_file,insertion_count_filtered,ir_size_cutoff,genes,contigs)
+        features,genes,contigs = gene_parser_gff(annotation_file)
+
+    return features,inter_gene_annotater(ir_size_cutoff,genes,contigs)
+
+def annotation_initializer(features,intergenic_features):
     
-    barcoded_insertions,insertions = [],[]
-    if barcode:
-        barcoded_insertions,insertions = insert_parser(insertion_count_filtered,name_folder,folder_path,barcode)
-
-    return insertion_count_filtered,barcoded_insertions,insertions
-
-def dict_filter(dictionary,read_cut):
-    for key in list(dictionary):
-        if dictionary[key].count < read_cut:
-            del dictionary[key]
-    return dictionary
-
-def insert_parser(insertion_count,name_folder,folder_path,barcode):    
-    insertions,barcoded_insertions = [],[]
-
-    for key in insertion_count: 
-
-        contig = [insertion_count[key].contig]
-        local = [insertion_count[key].local]
-        orientation = [insertion_count[key].orientation]
-        count = [insertion_count[key].count]
-        mapq = [insertion_count[key].mapQ]
-        gene_name = [insertion_count[key].name]
-        gene_product = [insertion_count[key].product]
-        gene_orientation = [insertion_count[key].gene_orient]
-        relative_gene_pos = [insertion_count[key].relative_gene_pos]
-        
-        barcodes,reads = '',0
-        for bar,read in insertion_count[key].barcode.items():
-            barcodes += f'{bar}:{read};'
-            reads += read
-            
-            ## for individual barcoded insertions
-            barcoded_insertions.append([bar] + [read] + contig + local +\
-                                       orientation + count + mapq + gene_name + \
-                                       gene_product + gene_orientation + relative_gene_pos)
+    ''' Pool initializer, publishes the parsed annotation to each worker. With
+    the fork start method the workers simply share the parent's copy.'''
+    
+    global annotation
+    annotation = (features,intergenic_features)
+
+def annotation_processer(store,start,end,read_cut,barcode_tables,part_path,output_format):
+
+    ''' Annotates the insertions of the store rows start to end that pass the
+    read threshold, and streams their barcoded tables when asked to. The rows
+    are read from the memory mapped insertion store.'''
+
+    features,intergenic_features = annotation
+    store = InsertionStore(store)
+    insertions = dict_filter(store.insertions(slice(start,end)),read_cut)
+    insertions = feature_annotater(insertions,features)
+    insertions = feature_annotater(insertions,intergenic_features,intergenic=True)
+    
+    if barcode_tables:
+        insert_parser(insertions,barcode_matrix(insertions,*store.barcodes(start,end),store.overflow),
+                      part_path,output_format)
+
+    return insertions
+
+def barcode_matrix(insertions,keys,codes,reads,overflow):
+    
+    ''' Builds the sparse Barcodes matrix of the insertion table from the 
+    (key, code, reads) barcode counts. Entries of insertions missing from the
+    table (filtered out by the read threshold) are dropped.'''
+    
+    rows = np.minimum(np.searchsorted(insertions.keys, keys), max(len(insertions) - 1, 0))
+    present = (insertions.keys[rows] == keys) if len(insertions) else np.zeros(len(keys), dtype=bool)
     
+    used, columns = np.unique(codes[present], return_inverse=True)
+    rows, columns, counts = coo_reducer(rows[present], columns.astype(np.int64), reads[present])
+    return Barcodes(rows, columns, counts, used, overflow)
 
-        insertions.append(contig + local + orientation + count + mapq + \
-                          gene_name + gene_product + gene_orientation + relative_gene_pos + \
-                          [len(insertion_count[key].barcode)] + [reads] + [barcodes])
+def dict_filter(insertions,read_cut):
+    return insertions.subset(insertions.count >= read_cut)
 
-    return barcoded_insertions,insertions
+def insert_parser(insertion_count,barcodes,part_path,output_format):
+    
+    ''' Streams the barcoded insertions of a worker into its part files, 
+    headerless, to be joined by annotate_barcodes_writer. The barcodes of 
+    each insertion are read from its row of the sparse matrix.'''
+    
+    names = barcodes.names()
+    columns, counts = barcodes.columns.tolist(), barcodes.counts.tolist()
+    row_borders = np.searchsorted(barcodes.rows, np.arange(len(insertion_count) + 1)).tolist()
+    
+    with TableStreamer(f"{part_path}_barcoded_insertions.{output_format}",barcoded_insertions_columns,
+                       output_format,header=False) as insertions,\
+         TableStreamer(f"{part_path}_annotated_barcodes.{output_format}",annotated_barcodes_columns,
+                       output_format,header=False) as barcoded_insertions:
+
+        for i,(contig,local,orientation,border,count,mapq,gene_name,gene_product,gene_orientation,relative_gene_pos) \
+            in enumerate(zip(*insertion_count.rows())): 
+    
+            site = [contig, local, orientation, count, mapq, gene_name, gene_product, gene_orientation, relative_gene_pos]
+            
+            site_barcodes,reads = '',0
+            for column,read in zip(columns[row_borders[i]:row_borders[i+1]],counts[row_borders[i]:row_borders[i+1]]):
+                site_barcodes += f'{names[column]}:{read};'
+                reads += read
+                
+                ## for individual barcoded insertions
+                barcoded_insertions.write([names[column]] + [read] + site)
+        
+            insertions.write(site + [row_borders[i+1] - row_borders[i]] + [reads] + [site_barcodes])
 
-def annotate_barcodes_writer(barcoded_insertions,insertions,name_folder,folder_path):
+def annotate_barcodes_writer(parts,part_folder,name_folder,folder_path,output_format="csv"):
     
-    insertions.insert(0, ["#Contig"] + ["position"] + ["Orientation"] + ["Total Reads"] + \
-                      ["Average MapQ"] + ["Gene Name"] + ["Gene Product"] + ["Gene Orientation"] + \
-                      ["Relative Position in Gene (0-1)"] + ["Number of different barcodes in coordinate"] + \
-                      ["Total barcode Reads"] + ["Barcodes (barcode:read)"])
+    for name,columns in (("barcoded_insertions",barcoded_insertions_columns),
+                         ("annotated_barcodes",annotated_barcodes_columns)):
+        table_concatenator(os.path.join(folder_path, f"{name}_{name_folder}.{output_format}"),columns,
+                           [os.path.join(part_folder, f"part_{part}_{name}.{output_format}") for part in range(parts)],
+                           output_format)
     
-    name = f"barcoded_insertions_{name_folder}.csv"
-    output_file_path = os.path.join(folder_path, name)
-    csv_writer(output_file_path,insertions)
+    shutil.rmtree(part_folder)
+
+class FeatureIndex():
     
-    ############
+    ''' Sorted interval index over the annotated features of a genome. Each
+    contig is cut into elementary segments at every feature border, and every
+    segment keeps the feature of highest priority covering it, so overlapping
+    features are resolved once, when the index is built. Annotating the 
+    insertions is then a binary search of their positions in the segment 
+    borders. Feature coordinates are closed intervals, [start, end].'''
     
-    barcoded_insertions.insert(0, ["#Barcode"] + ["Barcode Reads"] +\
-                               ["Contig"] + ["position"] + ["Orientation"] + ["Total Reads in position"] + \
-                              ["Average MapQ"] + ["Gene Name"] + ["Gene Product"] + ["Gene Orientation"] + \
-                              ["Relative Position in Gene (0-1)"])
+    def __init__(self, contig, start, end, size, name, product, orientation, priority):
         
-    name = f"annotated_barcodes_{name_folder}.csv"
-    output_file_path = os.path.join(folder_path, name)
-    csv_writer(output_file_path,barcoded_insertions)
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+        self.size = np.array(size, dtype=np.int64)
+        self.name = np.array(name, dtype=object)
+        self.product = np.array(product, dtype=object)
+        self.orientation = np.array(orientation, dtype=object)
+        priority = np.array(priority, dtype=np.int64)
+        contig = np.array(contig, dtype=object)
+        
+        self.segments = {}
+        for current in dict.fromkeys(contig.tolist()):
+            members = np.flatnonzero((contig == current) & (self.end >= self.start))
+            bounds = np.unique(np.concatenate((self.start[members], self.end[members] + 1)))
+            winner = np.full(len(bounds), -1, dtype=np.int64)
+            for i in members[np.argsort(priority[members], kind='stable')].tolist(): # lowest priority painted first
+                winner[np.searchsorted(bounds, self.start[i]):np.searchsorted(bounds, self.end[i] + 1)] = i
+            self.segments[current] = (bounds, winner)
 
-def inter_gene_annotater(annotation_file,insertion_count,ir_size_cutoff,genes,contigs):
+    def __len__(self):
+        return len(self.start)
+
+    def lookup(self, contig, local):
+        
+        ''' Returns the index of the feature annotating each position, -1 for
+        positions outside of any feature.'''
+        
+        if contig not in self.segments:
+            return np.full(len(local), -1, dtype=np.int64)
+        bounds, winner = self.segments[contig]
+        segment = np.searchsorted(bounds, local, side='right') - 1
+        feature = np.full(len(local), -1, dtype=np.int64)
+        inside = segment >= 0
+        feature[inside] = winner[segment[inside]]
+        return feature
+
+def feature_annotater(insertion_count,features,intergenic=False):
+    
+    ''' Annotates the insertions with the features of a FeatureIndex. As the 
+    insertion keys are sorted by contig, the insertions of each contig are a 
+    contiguous slice of the table. Intergenic features only annotate the 
+    insertions that were not placed in a gene.'''
+    
+    local = insertion_count.local
+    for contig in features.segments:
+        contig_id = insertion_count.contig_index(contig)
+        if contig_id == -1:
+            continue
+        
+        first, last = np.searchsorted(insertion_count.keys, [contig_id << 32, (contig_id + 1) << 32])
+        on_contig = np.arange(first, last)
+        if intergenic:
+            on_contig = on_contig[insertion_count.name[on_contig] == None]
+        
+        feature = features.lookup(contig, local[on_contig])
+        hits, feature = on_contig[feature != -1], feature[feature != -1]
+        
+        insertion_count.name[hits] = features.name[feature]
+        if not intergenic:
+            insertion_count.product[hits] = features.product[feature]
+            insertion_count.gene_orient[hits] = features.orientation[feature]
+        insertion_count.relative_gene_pos[hits] = (local[hits] - features.start[feature]) / features.size[feature]
+
+    return insertion_count
+
+def inter_gene_annotater(ir_size_cutoff,genes,contigs):
 
     ir_annotation = {}
     count = 0
@@ -408,31 +1344,31 @@ def inter_gene_annotater(annotation_file,insertion_count,ir_size_cutoff,genes,co
         if ir_name not in ir_annotation:
            ir_annotation[ir_name] = (0,genes[0][0],domain_size,contig)
     
-    for ir in ir_annotation:
-        for key in insertion_count:
-            if insertion_count[key].name is None:
-                if insertion_count[key].contig == ir_annotation[ir][3]:
-                    if (int(insertion_count[key].local) >= ir_annotation[ir][0]) & (int(insertion_count[key].local) <= ir_annotation[ir][1]):
-                        insertion_count[key].name = ir
-                        insertion_count[key].relative_gene_pos = (int(insertion_count[key].local) - ir_annotation[ir][0]) / ir_annotation[ir][2]
-             
-    return insertion_count
+    # the first intergenic region listed takes the insertions it overlaps
+    return FeatureIndex(contig=[ir[3] for ir in ir_annotation.values()],
+                        start=[ir[0] for ir in ir_annotation.values()],
+                        end=[ir[1] for ir in ir_annotation.values()],
+                        size=[ir[2] for ir in ir_annotation.values()],
+                        name=list(ir_annotation),
+                        product=[None] * len(ir_annotation),
+                        orientation=[None] * len(ir_annotation),
+                        priority=[-i for i in range(len(ir_annotation))])
 
-def gene_parser_genbank(annotation_file,insertion_count):
+def gene_parser_genbank(annotation_file):
     
     ''' The gene_info_parser_genbank function takes a genbank file as input and 
-    extracts gene information, storing it in a dictionary with Gene class 
-    instances as values. It parses the file using the SeqIO module, 
-    retrieving attributes such as start, end, orientation, identity, 
-    and product for each gene.''' 
+    extracts gene information into a FeatureIndex. It parses the file using 
+    the SeqIO module, retrieving attributes such as start, end, orientation, 
+    identity, and product for each gene.''' 
     
     contigs = {}
     genes = []
+    feature_columns = {"contig":[],"start":[],"end":[],"size":[],"name":[],"product":[],"orientation":[]}
     for rec in SeqIO.parse(annotation_file, "gb"):
         for feature in rec.features:
             if feature.type != 'source':
-                start = feature.location.start
-                end = feature.location.end
+                start = int(feature.location.start)
+                end = int(feature.location.end)
                 domain_size = end - start
                 
                 orientation = feature.location.strand
@@ -466,24 +1402,23 @@ def gene_parser_genbank(annotation_file,insertion_count):
                         gene = identity
 
                 genes.append((start,end,orientation,gene,rec.id))
-
-                for key in insertion_count:
-                    if insertion_count[key].contig == rec.id:
-                        if (int(insertion_count[key].local) >= start) & (int(insertion_count[key].local) <= end):
-                            insertion_count[key].name = gene
-                            insertion_count[key].product = product
-                            insertion_count[key].gene_orient = orientation
-                            insertion_count[key].relative_gene_pos = (int(insertion_count[key].local) - start) / domain_size
+                
+                for column,value in zip(feature_columns,(rec.id,start,end,domain_size,gene,product,orientation)):
+                    feature_columns[column].append(value)
 
         contigs[rec.id] = len(rec.seq)
         genes = list(dict.fromkeys(genes))
         genes.sort(key=lambda x: (x[-1], x[0])) #sort by start position of the gene and contig
-    return insertion_count,genes,contigs
+    
+    # overlapping genes: the last one in the file takes the insertions
+    features = FeatureIndex(**feature_columns, priority=list(range(len(feature_columns["start"]))))
+    return features,genes,contigs
 
-def gene_parser_gff(annotation_file,insertion_count):
+def gene_parser_gff(annotation_file):
     
     contigs = {}
     genes = []
+    feature_columns = {"contig":[],"start":[],"end":[],"size":[],"name":[],"product":[],"orientation":[]}
     with open(annotation_file) as current:
         for line in current:
             GB = line.split('\t') #len(GB)
@@ -519,13 +1454,8 @@ def gene_parser_gff(annotation_file,insertion_count):
                 contig = GB[0]
                 orientation = GB[6] #orientation of the gene
                 
-                for key in insertion_count:
-                    if insertion_count[key].contig == contig:
-                        if (int(insertion_count[key].local) >= start) & (int(insertion_count[key].local) <= end):
-                            insertion_count[key].name = gene
-                            insertion_count[key].product =  feature['product']
-                            insertion_count[key].gene_orient = orientation
-                            insertion_count[key].relative_gene_pos = (int(insertion_count[key].local) - start) / domain_size
+                for column,value in zip(feature_columns,(contig,start,end,domain_size,gene,feature['product'],orientation)):
+                    feature_columns[column].append(value)
                 
                 key = (start,end,orientation,gene,contig)
                 genes.append(key)
@@ -541,35 +1471,17 @@ def gene_parser_gff(annotation_file,insertion_count):
             colourful_errors("WARNING",
                 "Watch out, no genomic features were loaded. The gff file is not being parsed correctly, or was not loaded.")
 
-    return insertion_count,genes,contigs
+    # overlapping genes: the last one in the file takes the insertions
+    features = FeatureIndex(**feature_columns, priority=list(range(len(feature_columns["start"]))))
+    return features,genes,contigs
 
-def dictionary_parser(dictionary,folder_path,name_folder):
+def dictionary_parser(dictionary,folder_path,name_folder,output_format="csv",row_group_size=1000000):
     
-    insertions = []
-
-    for key in dictionary:
-
-        contig = [dictionary[key].contig]
-        local = [dictionary[key].local]
-        orientation = [dictionary[key].orientation]
-        border = [dictionary[key].seq]
-        count = [dictionary[key].count]
-        gene_name = [dictionary[key].name]
-        gene_product = [dictionary[key].product]
-        gene_orientation = [dictionary[key].gene_orient]
-        relative_gene_pos = [dictionary[key].relative_gene_pos]
-        mapQ = [dictionary[key].mapQ]
-        
-        insertions.append(contig + local + orientation + border + count + mapQ +\
-                          gene_name + gene_product + gene_orientation + relative_gene_pos)
-
-    insertions.insert(0, ["#Contig"] + ["position"] + ["Orientation"] + \
-                      ["Transposon Border Sequence"] + ["Read Counts"] + \
-                      ["Average mapQ across reads"] + ["Gene Name"] + ["Gene Product"] + \
-                      ["Gene Orientation"] + ["Relative Position in Gene (0-1)"])
-
-    output_file_path = os.path.join(folder_path, f"all_insertions_{name_folder}.csv") #all the unique insertions
-    csv_writer(output_file_path,insertions)
+    output_file_path = os.path.join(folder_path, f"all_insertions_{name_folder}") #all the unique insertions
+    
+    with TableStreamer(f"{output_file_path}.{output_format}",insertions_columns,output_format) as writer:
+        for i in range(0,len(dictionary),row_group_size):
+            writer.write_columns(dictionary.subset(slice(i,i+row_group_size)).rows())
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process SAM aligned files and extract relevant information.")
@@ -583,6 +1495,11 @@ if __name__ == "__main__":
     parser.add_argument("gb_annotation_file", help="Needs to be a standard .gb file")
     parser.add_argument("ir_size_cutoff", type=int, help="The number of bp up and down stream of any gene to be considered an intergenic region")
     parser.add_argument("cpu",type=int,help="Define the number of threads (must be and integer)")
+    parser.add_argument("--of",default="csv",help="Output table format, csv or parquet (requires pyarrow). Default is csv")
+    parser.add_argument("--bt",action="store_true",help="Also write the barcoded_insertions and annotated_barcodes tables, derived from the barcode matrix")
+    parser.add_argument("--ra",action="store_true",help="Re-annotate the insertion counts stored by a previous run, without parsing the SAM file")
+    parser.add_argument("--ap",action="store_true",help="Merge the counts of a new SAM file into the insertion store of a previous run")
+    parser.add_argument("--mem",type=int,default=None,help="Memory budget (in MB) for counting the reads. The parsed alignments are then spilled to sorted runs on disk and merged afterwards")
 
     args = parser.parse_args()
     
@@ -595,4 +1512,8 @@ if __name__ == "__main__":
           args.map_quality_threshold,
           args.gb_annotation_file,
           args.ir_size_cutoff,
-          args.cpu])
+          args.cpu,
+          args.of,
+          f"{args.bt}",
+          "reannotate" if args.ra else "append" if args.ap else "parse",
+          f"{args.mem}"])